@@ -0,0 +1,76 @@
+"""
+Import-time budget check.
+
+Runs `python -X importtime` in a fresh interpreter, reports the cumulative
+import cost of the project packages and fails if the budget is exceeded or if
+a heavy dependency (Tk, Pillow, requests) is loaded at import time.
+
+Usage:
+    python benchmarks/import_time.py [--budget-ms 50]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROJECT_MODULES = ["tracer", "story_archive", "image_caption", "story_gen", "ui", "main"]
+HEAVY_MODULES = ["tkinter", "_tkinter", "PIL", "requests", "urllib3"]
+DEFAULT_BUDGET_MS = 50.0
+
+
+def measure_imports(modules):
+    """Import `modules` in a fresh interpreter and return {module: cumulative_us}."""
+    code = "; ".join(f"import {name}" for name in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import failed:\n{result.stderr}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Maximum total cumulative import time of the project packages.")
+    args = parser.parse_args()
+
+    timings = measure_imports(PROJECT_MODULES)
+
+    total_ms = 0.0
+    print(f"{'module':<16}{'cumulative':>14}")
+    for name in PROJECT_MODULES:
+        ms = timings.get(name, 0) / 1000
+        total_ms += ms
+        print(f"{name:<16}{ms:>11.1f} ms")
+    print(f"{'total':<16}{total_ms:>11.1f} ms (budget {args.budget_ms:.1f} ms)")
+
+    failed = False
+    loaded_heavy = [name for name in HEAVY_MODULES if name in timings]
+    if loaded_heavy:
+        print(f"[FAIL] Heavy modules imported eagerly: {', '.join(loaded_heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("[FAIL] Import time budget exceeded.")
+        failed = True
+
+    if not failed:
+        print("[OK] Import time within budget.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,17 +2,19 @@
 Image Captioning Logic
 """
 
-import requests
 import base64
 from io import BytesIO
-from PIL import Image
+
+from tracer import span
 
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
 
 
 def resize_image(image_path, scale=0.5):
     """Resize image by a scale factor and return bytes."""
-    with Image.open(image_path) as img:
+    from PIL import Image
+
+    with span("image.preprocess", "image", path=image_path), Image.open(image_path) as img:
         new_size = (int(img.width * scale), int(img.height * scale))
         resized_img = img.resize(new_size, Image.LANCZOS)
         print(f"[INFO] Resized image to {new_size[0]}x{new_size[1]}")
@@ -24,6 +26,8 @@ def resize_image(image_path, scale=0.5):
 
 def generate_caption(image_path, detail_level='detailed'):
     """Generate a caption from an image."""
+    import requests
+
     resized_image_bytes = resize_image(image_path)
     img_base64 = base64.b64encode(resized_image_bytes).decode('utf-8')
 
@@ -37,8 +41,9 @@ def generate_caption(image_path, detail_level='detailed'):
     }
 
     print(f"[INFO] Sending image for {detail_level} captioning...")
-    response = requests.post(OLLAMA_API_URL, json=payload)
-    response.raise_for_status()
+    with span("caption.request", "model", model=payload["model"], detail_level=detail_level):
+        response = requests.post(OLLAMA_API_URL, json=payload)
+        response.raise_for_status()
 
     return response.json().get("response", "").strip()
 
@@ -1,8 +1,11 @@
 from image_caption import generate_caption
-from story_gen import generate_story, generate_one_shot_story, generate_title
-from ui.ui import setup_window, update_window, show_completion_message, update_status
+from story_gen import (generate_story, generate_title, CancellationToken, RunStats, ONE_SHOT_ENGINES,
+                       build_variants, generate_variants)
+from story_archive import StoryArchive
+from tracer import span, enable_tracing, export_chrome_trace, summary_table
 import os
 import random
+import signal
 
 def select_random_image(image_folder="images"):
     images = [f for f in os.listdir(image_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
@@ -12,8 +15,35 @@ def select_random_image(image_folder="images"):
     print(f"[INFO] Selected random image: {selected_image}")
     return os.path.join(image_folder, selected_image)
 
-def interactive_mode(caption, genre, max_words, creativity_level, consistency_mode, focus_mode):
-    window, text_widget = setup_window()
+def ask(prompt):
+    """input() that shows up as blocked time in the trace."""
+    with span("input.blocked", "input", prompt=prompt.strip()[:60]):
+        return input(prompt)
+
+def install_stop_handler(cancel_token):
+    """Make Ctrl+C stop generation gracefully; a second Ctrl+C quits."""
+    def handle_sigint(signum, frame):
+        if cancel_token.cancelled:
+            raise KeyboardInterrupt
+        print("\n[INFO] Stop requested. Keeping the story so far (press Ctrl+C again to quit).")
+        cancel_token.request_cancel()
+
+    signal.signal(signal.SIGINT, handle_sigint)
+
+def traced_poll(window):
+    """Poll hook for the cancel token that shows Tk redraws during streaming as `ui` spans."""
+    def poll():
+        with span("ui.poll", "ui"):
+            window.update()
+    return poll
+
+def interactive_mode(caption, genre, max_words, creativity_level, consistency_mode, focus_mode,
+                     cancel_token=None, run_stats=None):
+    from ui import setup_window, update_window, show_completion_message, update_status
+
+    cancel_token = cancel_token or CancellationToken()
+    window, text_widget = setup_window(on_stop=cancel_token.cancel)
+    cancel_token.poll = traced_poll(window)
     current_story = ""
     current_word_count = 0
     previous_instructions = []
@@ -24,7 +54,7 @@ def interactive_mode(caption, genre, max_words, creativity_level, consistency_mo
     continue_generation = True
     chunk_number = 1
     
-    while continue_generation and (max_words is None or current_word_count < max_words):
+    while continue_generation and (max_words is None or current_word_count < max_words) and not cancel_token.is_cancelled():
         # progress status
         update_status(window, f"Generating story chunk {chunk_number}...", "#f9e2af")
         
@@ -40,12 +70,19 @@ def interactive_mode(caption, genre, max_words, creativity_level, consistency_mo
             nearing_end=nearing_end,
             creativity_level=creativity_level,
             consistency_mode=consistency_mode,
-            focus_mode=focus_mode
+            focus_mode=focus_mode,
+            cancel_token=cancel_token,
+            run_stats=run_stats
         )
         
         current_story += "\n\n" + story_chunk
+        if run_stats is not None:
+            run_stats.add_chunk(story_chunk)
         current_word_count = len(current_story.split())
         update_window(window, text_widget, current_story)
+
+        if cancel_token.is_cancelled():
+            break
         
         progress_percent = min(100, (current_word_count / max_words * 100)) if max_words else 0
         if max_words:
@@ -74,16 +111,16 @@ def interactive_mode(caption, genre, max_words, creativity_level, consistency_mo
         print("  3. Action - Dynamic and event-driven storytelling.")
         print("  4. Balanced - A mix of description, dialogue, and action.\n")
 
-        change_settings = input("Would you like to change creativity/focus/consistency? (yes/no): ").strip().lower()
+        change_settings = ask("Would you like to change creativity/focus/consistency? (yes/no): ").strip().lower()
 
         if change_settings == "yes":
-            creativity_choice = input("Choose Creativity Level (1-3): ").strip()
+            creativity_choice = ask("Choose Creativity Level (1-3): ").strip()
             creativity_level = {"1": "conservative", "2": "balanced", "3": "creative"}.get(creativity_choice, creativity_level)
 
-            consistency_input = input("Enable Consistency Mode? (yes/no): ").strip().lower()
+            consistency_input = ask("Enable Consistency Mode? (yes/no): ").strip().lower()
             consistency_mode = consistency_input == "yes"
 
-            focus_choice = input("Choose Focus Mode (1-4): ").strip()
+            focus_choice = ask("Choose Focus Mode (1-4): ").strip()
             focus_mode = {"1": "descriptive", "2": "dialogue", "3": "action", "4": "balanced"}.get(focus_choice, focus_mode)
 
         print("\n")
@@ -94,7 +131,7 @@ def interactive_mode(caption, genre, max_words, creativity_level, consistency_mo
             break
 
         print("\nWould you like to continue, change genre, suggest changes, change+suggest, or stop?")
-        user_choice = input("Type 'continue', 'change', 'suggest', 'change+suggest', or 'stop': ").strip().lower()
+        user_choice = ask("Type 'continue', 'change', 'suggest', 'change+suggest', or 'stop': ").strip().lower()
 
         if user_choice == "stop":
             update_status(window, "Generating story conclusion...", "#f9e2af")
@@ -106,35 +143,108 @@ def interactive_mode(caption, genre, max_words, creativity_level, consistency_mo
                 ending=True,
                 creativity_level=creativity_level,
                 consistency_mode=consistency_mode,
-                focus_mode=focus_mode
+                focus_mode=focus_mode,
+                cancel_token=cancel_token,
+                run_stats=run_stats
             )
             current_story += "\n\n" + final_chunk
+            if run_stats is not None:
+                run_stats.add_chunk(final_chunk)
             update_window(window, text_widget, current_story)
             break
         elif user_choice == "change":
-            genre = input("Enter the new genre you want to switch to: ").strip()
+            genre = ask("Enter the new genre you want to switch to: ").strip()
             update_status(window, f"Genre changed to: {genre}", "#a6e3a1")
         elif user_choice == "suggest":
-            new_instruction = input("Enter your suggestion for the next part of the story: ").strip()
+            new_instruction = ask("Enter your suggestion for the next part of the story: ").strip()
             previous_instructions.append(new_instruction)
             update_status(window, "User suggestion added", "#a6e3a1")
         elif user_choice == "change+suggest":
-            genre = input("Enter the new genre you want to switch to: ").strip()
-            new_instruction = input("Enter your suggestion for the next part of the story: ").strip()
+            genre = ask("Enter the new genre you want to switch to: ").strip()
+            new_instruction = ask("Enter your suggestion for the next part of the story: ").strip()
             previous_instructions.append(new_instruction)
             update_status(window, f"Genre changed to {genre} and suggestion added", "#a6e3a1")
         
         chunk_number += 1
 
     # completion message
-    show_completion_message(window)
-    window.mainloop()
+    if cancel_token.is_cancelled():
+        update_status(window, "Generation stopped. Keeping the story so far.", "#f38ba8")
+    else:
+        show_completion_message(window)
+    with span("ui.mainloop", "input"):
+        window.mainloop()
+    cancel_token.poll = None
     return current_story
 
-def main(output_file='result.txt'):
+def ask_list(prompt, choices, default):
+    """Ask for a comma-separated list of menu numbers and map them through `choices`."""
+    answer = ask(prompt).strip()
+    values = [choices[item.strip()] for item in answer.split(",") if item.strip() in choices]
+    return list(dict.fromkeys(values)) or [default]
+
+def fan_out_mode(image_path, caption, detail_level, engine, archive_dir):
+    genres = [g.strip() for g in ask("\nGenres, comma-separated (default: Horror, Sci-Fi, Comedy): ").split(",") if g.strip()]
+    genres = genres or ["Horror", "Sci-Fi", "Comedy"]
+
+    print("\nCreativity levels: 1. Conservative  2. Balanced  3. Creative")
+    creativity_levels = ask_list("Enter one or more, comma-separated (default 2): ",
+                                 {"1": "conservative", "2": "balanced", "3": "creative"}, "balanced")
+
+    print("\nFocus modes: 1. Descriptive  2. Dialogue  3. Action  4. Balanced")
+    focus_modes = ask_list("Enter one or more, comma-separated (default 4): ",
+                           {"1": "descriptive", "2": "dialogue", "3": "action", "4": "balanced"}, "balanced")
+
+    lengths_input = ask("\nStory lengths in words, comma-separated (default 1000): ")
+    lengths = [int(item) for item in lengths_input.replace(" ", "").split(",") if item.isdigit()] or [1000]
+
+    parallel_input = ask("\nMaximum stories/requests in flight (default 3): ").strip()
+    max_parallel = int(parallel_input) if parallel_input.isdigit() and int(parallel_input) > 0 else 3
+
+    variants = build_variants(genres, creativity_levels, focus_modes, lengths)
+    image_name = os.path.splitext(os.path.basename(image_path))[0]
+    output_dir = os.path.join("fanout", image_name)
+
+    cancel_token = CancellationToken()
+    install_stop_handler(cancel_token)
+
+    results = generate_variants(caption, variants, engine=engine, output_dir=output_dir,
+                                max_parallel=max_parallel, cancel_token=cancel_token)
+
+    finished = [result for result in results if not result["error"] and result["story"].strip()]
+    for result in results:
+        if result["error"]:
+            print(f"[WARNING] {result['name']} failed and was not archived: {result['error']}")
+
+    with span("file.write", "io", path=archive_dir), StoryArchive(archive_dir) as archive:
+        for result in finished:
+            variant = result["variant"]
+            run_stats = result["stats"]
+            story_id = archive.add({
+                "title": result["title"],
+                "caption": caption,
+                "genre": variant["genre"],
+                "image": image_path,
+                "params": {
+                    "mode": "fan-out",
+                    "engine": engine,
+                    "creativity_level": variant["creativity_level"],
+                    "consistency_mode": variant["consistency_mode"],
+                    "focus_mode": variant["focus_mode"],
+                    "detail_level": detail_level,
+                    "max_words": variant["max_words"],
+                },
+                "chunks": [chunk for chunk in run_stats.chunks if chunk.strip()] or [result["story"].strip()],
+                "stats": run_stats.as_dict(),
+            })
+            print(f"[INFO] #{story_id} {result['name']}: {result['title']} ({run_stats.summary()})")
+
+    print(f"\n✅ [INFO] {len(finished)} of {len(results)} variants saved to '{output_dir}' and the '{archive_dir}' archive.")
+
+def main(archive_dir='archive'):
     print("[INFO] Starting Image Caption and Story Generation Pipeline...")
 
-    user_image_path = input("Enter the image path (leave blank for random selection): ").strip()
+    user_image_path = ask("Enter the image path (leave blank for random selection): ").strip()
 
     if user_image_path:
         image_path = user_image_path
@@ -144,21 +254,34 @@ def main(output_file='result.txt'):
     print("\nChoose Story Generation Mode:")
     print("1. One-Shot Mode (full story at once)")
     print("2. Interactive Mode (step-by-step with suggestions)")
-    mode_choice = input("Enter 1 or 2: ").strip()
+    print("3. Fan-Out Mode (one image, many genre/setting variants)")
+    mode_choice = ask("Enter 1, 2 or 3: ").strip()
+
+    engine = "sequential"
+    if mode_choice in ("1", "3"):
+        print("\nChoose One-Shot engine:")
+        print("1. Sequential - Each chunk continues from the previous one.")
+        print("2. Outline - Plan an outline, then write sections in parallel (faster with OLLAMA_NUM_PARALLEL > 1).")
+        engine_choice = ask("Enter 1 or 2: ").strip()
+        engine = "outline" if engine_choice == "2" else "sequential"
 
     print("\nChoose caption detail level:")
     print("1. Very Detailed Caption (full scene, objects, surroundings)")
     print("2. Short Caption (2-3 sentences, main subject only)")
-    detail_choice = input("Enter 1 for Detailed or 2 for Short: ").strip()
+    detail_choice = ask("Enter 1 for Detailed or 2 for Short: ").strip()
 
     detail_level = "short" if detail_choice == "2" else "detailed"
 
     caption = generate_caption(image_path, detail_level)
     print(f"\n[CAPTION]: {caption}")
 
-    genre = input("\nChoose a genre for your story (e.g., Horror, Sci-Fi, Fantasy, Romance, Comedy): ").strip()
+    if mode_choice == "3":
+        fan_out_mode(image_path, caption, detail_level, engine, archive_dir)
+        return
+
+    genre = ask("\nChoose a genre for your story (e.g., Horror, Sci-Fi, Fantasy, Romance, Comedy): ").strip()
 
-    user_input = input("\nSet the maximum word limit for your story (default is 8000 words): ").strip().lower()
+    user_input = ask("\nSet the maximum word limit for your story (default is 8000 words): ").strip().lower()
     try:
         max_words = int(user_input)
     except ValueError:
@@ -170,13 +293,13 @@ def main(output_file='result.txt'):
     print("1. Conservative - Logical and grounded storytelling. Less surprises.")
     print("2. Balanced - Mix of creativity and structure. Good for most genres.")
     print("3. Creative - Wild, unexpected ideas. Higher randomness.")
-    creativity_choice = input("Enter 1, 2, or 3: ").strip()
+    creativity_choice = ask("Enter 1, 2, or 3: ").strip()
     creativity_map = {"1": "conservative", "2": "balanced", "3": "creative"}
     creativity_level = creativity_map.get(creativity_choice, "balanced")
 
     print("\nEnable Consistency Mode? (yes/no):")
     print("Consistency Mode helps enforce logical continuity in the story to avoid contradictions and plot holes.")
-    consistency_input = input("Enter yes or no: ").strip().lower()
+    consistency_input = ask("Enter yes or no: ").strip().lower()
     consistency_mode = consistency_input == "yes" 
 
     print("\nChoose focus mode:")
@@ -184,30 +307,47 @@ def main(output_file='result.txt'):
     print("2. Dialogue - Emphasize character interactions and conversations.")
     print("3. Action - Focus on dynamic scenes and plot progression.")
     print("4. Balanced - Balance description, dialogue, and action.")
-    focus_choice = input("Enter 1, 2, 3, or 4: ").strip()
+    focus_choice = ask("Enter 1, 2, 3, or 4: ").strip()
     focus_map = {"1": "descriptive", "2": "dialogue", "3": "action", "4": "balanced"}
     focus_mode = focus_map.get(focus_choice, "balanced")
 
+    cancel_token = CancellationToken()
+    install_stop_handler(cancel_token)
+    run_stats = RunStats()
+
     if mode_choice == "1":
         # one shot mode
-        print("\n[INFO] Generating complete story in one-shot mode...")
-        story = generate_one_shot_story(
+        from ui import setup_window, update_window, show_completion_message, update_status
+
+        window, text_widget = setup_window(on_stop=cancel_token.cancel)
+        cancel_token.poll = traced_poll(window)
+        update_status(window, "Generating complete story in one-shot mode...", "#f9e2af")
+
+        print(f"\n[INFO] Generating complete story in one-shot mode ({engine} engine)...")
+        story = ONE_SHOT_ENGINES[engine](
             caption=caption,
             genre=genre,
             max_words=max_words,
             creativity_level=creativity_level,
             consistency_mode=consistency_mode,
-            focus_mode=focus_mode
+            focus_mode=focus_mode,
+            cancel_token=cancel_token,
+            run_stats=run_stats
         )
         
         # completed story
-        window, text_widget = setup_window()
         update_window(window, text_widget, story)
-        show_completion_message(window)
+        if cancel_token.is_cancelled():
+            update_status(window, "Generation stopped. Keeping the story so far.", "#f38ba8")
+            print("\n[INFO] Story generation stopped. The story so far is in the UI window.")
+        else:
+            show_completion_message(window)
+            print("\n[INFO] Story generation complete! Check the UI window.")
         
-        print("\n[INFO] Story generation complete! Check the UI window.")
         print("Close the UI window when you're done reading.")
-        window.mainloop()
+        with span("ui.mainloop", "input"):
+            window.mainloop()
+        cancel_token.poll = None
         
     else:
         story = interactive_mode(
@@ -216,20 +356,54 @@ def main(output_file='result.txt'):
             max_words=max_words,
             creativity_level=creativity_level,
             consistency_mode=consistency_mode,
-            focus_mode=focus_mode
+            focus_mode=focus_mode,
+            cancel_token=cancel_token,
+            run_stats=run_stats
         )
-
-    title = generate_title(story, genre)
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(f"[TITLE]\n{title}\n\n")
-        f.write("[CAPTION]\n")
-        f.write(caption + "\n")
-        f.write("\n" + "="*30 + "\n\n")
-        f.write(f"[STORY] (Genre: {genre})\n")
-        f.write(story)
-
-    print(f"\n✅ [INFO] Story saved to {output_file} with Title: {title}")
+        print(f"[INFO] {run_stats.summary()}")
+
+    if not story.strip():
+        print("\n[WARNING] Stopped before any story text was written, nothing to archive.")
+        return
+
+    title = generate_title(story, genre, cancel_token=cancel_token)
+
+    with span("file.write", "io", path=archive_dir), StoryArchive(archive_dir) as archive:
+        story_id = archive.add({
+            "title": title,
+            "caption": caption,
+            "genre": genre,
+            "image": image_path,
+            "params": {
+                "mode": "one-shot" if mode_choice == "1" else "interactive",
+                "engine": engine if mode_choice == "1" else None,
+                "creativity_level": creativity_level,
+                "consistency_mode": consistency_mode,
+                "focus_mode": focus_mode,
+                "detail_level": detail_level,
+                "max_words": max_words,
+            },
+            "chunks": [chunk for chunk in run_stats.chunks if chunk.strip()] or [story.strip()],
+            "stats": run_stats.as_dict(),
+        })
+
+    print(f"\n✅ [INFO] Story #{story_id} saved to the '{archive_dir}' archive with Title: {title}")
+    print(f"[INFO] View it with: python -m story_archive --archive {archive_dir} show {story_id}")
+
+def run_traced(trace_path):
+    """Run the pipeline with tracing on and export a Chrome trace to `trace_path`."""
+    enable_tracing()
+    try:
+        with span("pipeline.run"):
+            main()
+    finally:
+        export_chrome_trace(trace_path)
+        print("\n" + summary_table())
+        print(f"[INFO] Trace written to {trace_path} (open it in https://ui.perfetto.dev)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    trace_path = os.environ.get("STORY_TRACE")
+    if trace_path:
+        run_traced(trace_path)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,5 @@
+"""
+Story Archive Module
+"""
+
+from .archive import StoryArchive, ArchiveError
@@ -0,0 +1,83 @@
+"""
+Command line access to the story archive.
+
+Usage:
+    python -m story_archive search "lighthouse storm" genre=Horror creativity_level=creative
+    python -m story_archive show 42
+    python -m story_archive list
+    python -m story_archive compact
+"""
+
+import argparse
+import os
+import sys
+
+from .archive import StoryArchive, ArchiveError, METADATA_FIELDS
+
+
+def _print_row(story):
+    words = sum(len(chunk.split()) for chunk in story.get("chunks", []))
+    print(f"{story['id']:>6}  {story.get('created', ''):<19}  {story.get('genre', ''):<12.12}  "
+          f"{words:>6} words  {story.get('title', '')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m story_archive", description="Search the story archive.")
+    parser.add_argument("--archive", default="archive", help="Archive directory.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="Full-text and metadata search.")
+    search.add_argument("terms", nargs="*",
+                        help=f"Words to match, plus field=value filters ({', '.join(METADATA_FIELDS)}).")
+    search.add_argument("--limit", type=int, default=20)
+
+    show = commands.add_parser("show", help="Print a story.")
+    show.add_argument("id", type=int)
+
+    listing = commands.add_parser("list", help="List the newest stories.")
+    listing.add_argument("--limit", type=int, default=20)
+
+    commands.add_parser("compact", help="Fold recently added stories into the main index.")
+
+    args = parser.parse_args()
+    if not os.path.isdir(args.archive):
+        print(f"[ERROR] No archive found at '{args.archive}'.")
+        sys.exit(1)
+
+    try:
+        _run(args)
+    except KeyError as e:
+        print(f"[ERROR] No story with id {e.args[0]} in '{args.archive}'.")
+        sys.exit(1)
+    except ArchiveError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+
+def _run(args):
+    with StoryArchive(args.archive) as archive:
+        if args.command == "search":
+            words = [term for term in args.terms if "=" not in term]
+            filters = dict(term.split("=", 1) for term in args.terms if "=" in term)
+            story_ids = archive.search(" ".join(words), **filters)
+            shown = story_ids[:args.limit] if args.limit else story_ids
+            for story in archive.iter_stories(shown):
+                _print_row(story)
+            print(f"[INFO] Showing {len(shown)} of {len(story_ids)} matching stories.")
+        elif args.command == "show":
+            story = archive.get(args.id)
+            print(f"[TITLE]\n{story.get('title', '')}\n")
+            print(f"[CAPTION]\n{story.get('caption', '')}\n")
+            print(f"[STORY] (Genre: {story.get('genre', '')})")
+            print("\n\n".join(story.get("chunks", [])))
+        elif args.command == "list":
+            story_ids = archive.search(limit=args.limit)
+            for story in archive.iter_stories(story_ids):
+                _print_row(story)
+        elif args.command == "compact":
+            archive.compact()
+            print(f"[INFO] Compacted index of {len(archive)} stories.")
+
+
+if __name__ == "__main__":
+    main()
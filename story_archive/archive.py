@@ -0,0 +1,520 @@
+"""
+Append-only story archive with an inverted index.
+
+Layout of an archive directory:
+
+    stories.dat     records: magic, payload length, crc32, zlib-compressed JSON
+    stories.off     one little-endian u64 record offset per story id
+    index.<gen>.lex compacted index: sorted term table followed by u32 story id postings
+    index.cur       generation number of the current lexicon
+    index.log       terms of stories added since the last compaction, one line per story
+
+Records are never rewritten. Lookups and searches go through memory maps of
+the data, offset and index files, so a large archive can be queried without
+loading it. Stories added since the last compaction are indexed from the
+small `index.log`; `compact()` merges them with the current lexicon into the
+next generation, streaming the postings straight to disk, and then moves
+`index.cur` to it. Lexicon files are never modified once written, so readers
+(in this or other processes) keep a valid map of the generation they opened.
+
+Writers hold an exclusive `flock` on `stories.dat`, so several processes can
+add to the same archive. Where `fcntl` is unavailable (Windows) writes are
+only serialized within one process.
+"""
+
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+RECORD_HEADER = struct.Struct("<4sII")
+RECORD_MAGIC = b"STRY"
+OFFSET = struct.Struct("<Q")
+LEX_HEADER = struct.Struct("<4sIIQ")
+LEX_MAGIC = b"SLEX"
+LEX_ENTRY = struct.Struct("<IHQI")
+POSTING = struct.Struct("<I")
+
+# stories indexed in the log before `add` compacts automatically
+COMPACT_EVERY = 500
+
+METADATA_FIELDS = ("genre", "creativity_level", "focus_mode", "consistency_mode", "mode", "engine")
+_WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+class ArchiveError(Exception):
+    """Raised when the archive files are missing or corrupt."""
+
+
+def _normalize(value):
+    return "_".join(str(value).lower().split())
+
+
+def metadata_term(field, value):
+    """Index term for a metadata field, e.g. `genre:sci-fi`."""
+    return f"{field}:{_normalize(value)}"
+
+
+def text_terms(text):
+    """Lowercase word terms of `text` (single characters are skipped)."""
+    return {word for word in _WORD_RE.findall(text.lower()) if len(word) > 1}
+
+
+def story_terms(story):
+    terms = text_terms(" ".join([story.get("title", ""), story.get("caption", "")] + story.get("chunks", [])))
+    params = story.get("params", {})
+    for field in METADATA_FIELDS:
+        value = story.get(field, params.get(field))
+        if value is not None and value != "":
+            terms.add(metadata_term(field, value))
+    return terms
+
+
+class _MappedFile:
+    """
+    Read-only memory map of a file that is remapped when the file grows or is
+    replaced. An `immutable` file is mapped once and kept, even if it is deleted.
+    """
+
+    def __init__(self, path, immutable=False):
+        self.path = path
+        self.immutable = immutable
+        self._map = None
+        self._key = None
+
+    def view(self):
+        if self.immutable and self._map is not None:
+            return self._map
+        try:
+            stat = os.stat(self.path)
+            key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            key = None
+        if key != self._key:
+            self.close()
+            if key is not None and key[1]:
+                with open(self.path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._key = key
+        return self._map if self._map is not None else b""
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._key = None
+
+
+class StoryArchive:
+    """
+    Append-only store of generated stories.
+
+    Usage:
+        with StoryArchive("archive") as archive:
+            story_id = archive.add({"title": ..., "caption": ..., "genre": ..., "chunks": [...]})
+            for story_id in archive.search("lighthouse storm", genre="Horror"):
+                print(archive.get(story_id)["title"])
+    """
+
+    def __init__(self, path="archive"):
+        """Open the archive at `path`. The directory is only created by the first `add`."""
+        self.path = path
+
+        self._data_path = os.path.join(path, "stories.dat")
+        self._offsets_path = os.path.join(path, "stories.off")
+        self._pointer_path = os.path.join(path, "index.cur")
+        self._log_path = os.path.join(path, "index.log")
+
+        self._data = _MappedFile(self._data_path)
+        self._offsets = _MappedFile(self._offsets_path)
+        self._generation = 0
+        self._pointer_key = None
+        self._lex = _MappedFile(self._lex_file(0), immutable=True)
+        self._lock = threading.Lock()
+
+        self._log_postings = {}
+        self._log_count = 0
+        self._log_key = None
+        self._load_log()
+        if os.path.isdir(path):
+            self._recover()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self._offsets.view()) // OFFSET.size
+
+    def close(self):
+        for mapped in (self._data, self._offsets, self._lex):
+            mapped.close()
+
+    # ---- Writing ----
+
+    def add(self, story):
+        """
+        Append a story and index it. Returns its id.
+
+        `story` is a dict with `title`, `caption`, `genre`, `params` (generation
+        settings), `chunks` (list of chunk texts) and optional `stats`.
+        """
+        story = dict(story)
+        story.setdefault("created", time.strftime("%Y-%m-%dT%H:%M:%S"))
+        payload = zlib.compress(json.dumps(story, ensure_ascii=False).encode("utf-8"))
+        header = RECORD_HEADER.pack(RECORD_MAGIC, len(payload), zlib.crc32(payload))
+
+        with self._write_lock() as data:
+            data.seek(0, os.SEEK_END)
+            offset = data.tell()
+            data.write(header + payload)
+            data.flush()
+            os.fsync(data.fileno())
+
+            with open(self._offsets_path, "ab") as f:
+                story_id = f.tell() // OFFSET.size
+                f.write(OFFSET.pack(offset))
+
+            self._append_log(story_id, story_terms(story))
+            if self._log_count >= COMPACT_EVERY:
+                self._compact_locked()
+
+        return story_id
+
+    def compact(self):
+        """Fold the stories indexed in `index.log` into the memory-mapped lexicon."""
+        with self._write_lock():
+            self._compact_locked()
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Hold the thread lock and an exclusive flock on the data file, and bring
+        the in-memory log index up to date. Yields the data file opened for appending.
+        """
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._data_path, "ab") as data:
+                if fcntl is not None:
+                    fcntl.flock(data.fileno(), fcntl.LOCK_EX)
+                try:
+                    self._refresh_log()
+                    yield data
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(data.fileno(), fcntl.LOCK_UN)
+
+    # ---- Reading ----
+
+    def get(self, story_id):
+        """Load one story by id."""
+        offsets = self._offsets.view()
+        if not 0 <= story_id < len(offsets) // OFFSET.size:
+            raise KeyError(story_id)
+        (offset,) = OFFSET.unpack_from(offsets, story_id * OFFSET.size)
+
+        data = self._data.view()
+        magic, length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if magic != RECORD_MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+            raise ArchiveError(f"Corrupt record for story {story_id} at offset {offset}.")
+
+        story = json.loads(zlib.decompress(payload).decode("utf-8"))
+        story["id"] = story_id
+        return story
+
+    def iter_stories(self, story_ids=None):
+        """Yield stories one at a time (all of them, newest first, if `story_ids` is None)."""
+        if story_ids is None:
+            story_ids = range(len(self) - 1, -1, -1)
+        for story_id in story_ids:
+            yield self.get(story_id)
+
+    def search(self, query="", limit=None, **filters):
+        """
+        Ids of stories containing every word of `query` and matching every
+        metadata filter (e.g. `genre="Horror"`, `creativity_level="creative"`),
+        newest first.
+        """
+        self._refresh_log()
+        terms = sorted(text_terms(query))
+        terms += [metadata_term(field, value) for field, value in filters.items() if value is not None]
+        if not terms:
+            ids = range(len(self) - 1, -1, -1)
+            return list(ids)[:limit] if limit else list(ids)
+
+        result = None
+        # rarest terms first keeps the intersections small
+        for postings in sorted((self._postings(term) for term in terms), key=len):
+            result = postings if result is None else result & postings
+            if not result:
+                return []
+        ids = sorted(result, reverse=True)
+        return ids[:limit] if limit else ids
+
+    # ---- Index internals ----
+
+    def _postings(self, term):
+        ids = set(self._lex_postings(term))
+        ids.update(self._log_postings.get(term, ()))
+        return ids
+
+    def _lex_file(self, generation):
+        # generation 0 is the single lexicon of archives written before generations
+        name = "index.lex" if generation == 0 else f"index.{generation}.lex"
+        return os.path.join(self.path, name)
+
+    def _lex_view(self):
+        """Map of the current lexicon, following `index.cur` when a compaction moved it."""
+        for _ in range(3):
+            key = _stat_key(self._pointer_path)
+            if key != self._pointer_key:
+                self._pointer_key = key
+                generation = _read_generation(self._pointer_path)
+                if generation != self._generation:
+                    self._lex.close()
+                    self._generation = generation
+                    self._lex = _MappedFile(self._lex_file(generation), immutable=True)
+            view = self._lex.view()
+            if view or self._generation == 0:
+                return view
+            # another process compacted again and removed this generation before we mapped it
+            self._pointer_key = None
+        raise ArchiveError(f"Index lexicon generation {self._generation} is missing.")
+
+    def _lex_postings(self, term):
+        lex = self._lex_view()
+        if not lex:
+            return []
+        magic, count, _, postings_start = LEX_HEADER.unpack_from(lex, 0)
+        if magic != LEX_MAGIC:
+            raise ArchiveError("Corrupt index lexicon.")
+
+        key = term.encode("utf-8")
+        blob = LEX_HEADER.size + count * LEX_ENTRY.size
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            term_off, term_len, post_off, doc_count = LEX_ENTRY.unpack_from(
+                lex, LEX_HEADER.size + middle * LEX_ENTRY.size)
+            candidate = lex[blob + term_off:blob + term_off + term_len]
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                start = postings_start + post_off
+                return [POSTING.unpack_from(lex, start + i * POSTING.size)[0] for i in range(doc_count)]
+        return []
+
+    def _indexed_count(self):
+        lex = self._lex_view()
+        return LEX_HEADER.unpack_from(lex, 0)[2] if lex else 0
+
+    def _load_log(self):
+        self._log_postings = {}
+        self._log_count = 0
+        self._log_key = None
+        if not os.path.exists(self._log_path):
+            return
+        mtime = os.stat(self._log_path).st_mtime_ns
+        size = 0
+        with open(self._log_path, "rb") as f:
+            for line in f:
+                # a line still being written by another process is picked up on the next refresh
+                if not line.endswith(b"\n"):
+                    break
+                size += len(line)
+                story_id, _, terms = line.decode("utf-8").rstrip("\n").partition("\t")
+                if not story_id.isdigit():
+                    continue
+                self._index_in_memory(int(story_id), terms.split(" "))
+        self._log_key = (size, mtime)
+
+    def _log_stat(self):
+        try:
+            stat = os.stat(self._log_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _refresh_log(self):
+        """Reload `index.log` if another process appended to or compacted it."""
+        if self._log_stat() != self._log_key:
+            self._load_log()
+
+    def _index_in_memory(self, story_id, terms):
+        for term in terms:
+            if term:
+                self._log_postings.setdefault(term, set()).add(story_id)
+        self._log_count += 1
+
+    def _append_log(self, story_id, terms):
+        line = f"{story_id}\t{' '.join(sorted(terms))}\n".encode("utf-8")
+        with open(self._log_path, "ab") as f:
+            f.write(line)
+        # only called under the write lock, so nobody else appended in between
+        self._log_key = self._log_stat()
+        self._index_in_memory(story_id, terms)
+
+    def _recover(self):
+        """
+        Drop a partially written offset entry and index stories whose record
+        was written but whose index entry was not.
+        """
+        with self._write_lock():
+            if os.path.exists(self._offsets_path):
+                size = os.path.getsize(self._offsets_path)
+                if size % OFFSET.size:
+                    with open(self._offsets_path, "r+b") as f:
+                        f.truncate(size - size % OFFSET.size)
+
+            logged = set()
+            for ids in self._log_postings.values():
+                logged.update(ids)
+            for story_id in range(self._indexed_count(), len(self)):
+                if story_id not in logged:
+                    self._append_log(story_id, story_terms(self.get(story_id)))
+
+    def _compact_locked(self):
+        """
+        Write the next lexicon generation: the current lexicon merged with the
+        log. Only the term table is built in memory; postings are copied from
+        the mapped lexicon to the new file term by term.
+        """
+        lex = self._lex_view()
+        if lex and LEX_HEADER.unpack_from(lex, 0)[0] != LEX_MAGIC:
+            raise ArchiveError("Corrupt index lexicon.")
+        indexed = self._indexed_count()
+        # stories below `indexed` are already in the lexicon
+        log_terms = sorted(
+            (term.encode("utf-8"), sorted(story_id for story_id in ids if story_id >= indexed))
+            for term, ids in self._log_postings.items()
+        )
+
+        entries, blob = bytearray(), bytearray()
+        post_off = 0
+        for key, _, lex_count, log_ids in _merged_terms(lex, log_terms):
+            doc_count = lex_count + len(log_ids)
+            entries += LEX_ENTRY.pack(len(blob), len(key), post_off, doc_count)
+            blob += key
+            post_off += doc_count * POSTING.size
+
+        generation = self._generation + 1
+        path = self._lex_file(generation)
+        term_count = len(entries) // LEX_ENTRY.size
+        postings_start = LEX_HEADER.size + len(entries) + len(blob)
+        with open(path + ".tmp", "wb") as f:
+            f.write(LEX_HEADER.pack(LEX_MAGIC, term_count, len(self), postings_start))
+            f.write(entries)
+            f.write(blob)
+            del entries, blob
+            for _, start, lex_count, log_ids in _merged_terms(lex, log_terms):
+                if lex_count:
+                    f.write(lex[start:start + lex_count * POSTING.size])
+                if log_ids:
+                    f.write(struct.pack(f"<{len(log_ids)}I", *log_ids))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        _write_atomic(self._pointer_path, str(generation).encode("ascii"))
+
+        # unmap before removing, which fails on Windows while a file is mapped
+        del lex
+        self._lex_view()
+        self._remove_old_lexicons(generation)
+
+        open(self._log_path, "w", encoding="utf-8").close()
+        self._log_postings = {}
+        self._log_count = 0
+        self._log_key = self._log_stat()
+
+    def _remove_old_lexicons(self, generation):
+        """Delete earlier generations; ones still mapped elsewhere are retried next time."""
+        for name in os.listdir(self.path):
+            match = re.fullmatch(r"index(?:\.(\d+))?\.lex(\.tmp)?", name)
+            if match and int(match.group(1) or 0) < generation:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+
+def _merged_terms(lex, log_terms):
+    """
+    Walk the sorted lexicon entries and the sorted `(key, ids)` log terms side
+    by side. Yields `(key, postings_start, postings_count, log_ids)` per term,
+    where the lexicon postings are `postings_count` u32s at `postings_start` in `lex`.
+    """
+    count = postings_start = 0
+    if lex:
+        _, count, _, postings_start = LEX_HEADER.unpack_from(lex, 0)
+    blob = LEX_HEADER.size + count * LEX_ENTRY.size
+
+    index = position = 0
+    lex_entry = None
+    while index < count or position < len(log_terms):
+        if lex_entry is None and index < count:
+            term_off, term_len, post_off, doc_count = LEX_ENTRY.unpack_from(
+                lex, LEX_HEADER.size + index * LEX_ENTRY.size)
+            lex_entry = (bytes(lex[blob + term_off:blob + term_off + term_len]),
+                         postings_start + post_off, doc_count)
+        log_key, log_ids = log_terms[position] if position < len(log_terms) else (None, ())
+
+        if lex_entry is not None and (log_key is None or lex_entry[0] <= log_key):
+            same = lex_entry[0] == log_key
+            yield lex_entry + (log_ids if same else (),)
+            index += 1
+            lex_entry = None
+            position += same
+        else:
+            if log_ids:
+                yield log_key, 0, 0, log_ids
+            position += 1
+
+
+def _stat_key(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _read_generation(path):
+    try:
+        with open(path, encoding="ascii") as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _write_atomic(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    for attempt in range(20):
+        try:
+            os.replace(temp_path, path)
+            return
+        except PermissionError:
+            # Windows refuses while another process has the file open for a moment
+            if attempt == 19:
+                raise
+            time.sleep(0.05)
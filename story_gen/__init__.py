@@ -4,4 +4,19 @@ Story Generation Module
 
 from .story_gen import generate_story
 from .one_shot_gen import generate_one_shot_story
+from .outline_gen import generate_outline_story
 from .generate_title import generate_title
+from .cancellation import CancellationToken
+from .run_stats import RunStats
+from .chunk_planner import ChunkPlanner
+from .repetition import RepetitionDetector
+from .fanout import build_variants, generate_variants
+
+# Selectable one-shot engines. Both take the caption plus genre, max_words,
+# creativity_level, output_file, consistency_mode, focus_mode, cancel_token,
+# run_stats, num_ctx, planner and seed; engine-specific options (chunk_size,
+# max_attempts, max_parallel) are not shared
+ONE_SHOT_ENGINES = {
+    "sequential": generate_one_shot_story,
+    "outline": generate_outline_story,
+}
@@ -0,0 +1,80 @@
+"""
+Cooperative cancellation for in-flight generation requests.
+"""
+
+import threading
+
+
+class CancellationToken:
+    """
+    Shared stop flag checked by every stage of the generation pipeline.
+
+    `poll` is an optional callable run before each check (e.g. `window.update`)
+    so a GUI stop button can be pressed while a response is streaming. It is
+    only called from the thread that created the token.
+    """
+
+    def __init__(self, poll=None):
+        self.poll = poll
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._owner_thread = threading.get_ident()
+
+    @property
+    def cancelled(self):
+        """Current state of the flag, without polling."""
+        return self._event.is_set()
+
+    def is_cancelled(self):
+        """
+        Run the poll hook (if any) and report whether cancellation was requested.
+        Callbacks still pending from `request_cancel` run here.
+        """
+        if self.poll is not None and threading.get_ident() == self._owner_thread:
+            self.poll()
+        if self._event.is_set():
+            self._run_callbacks()
+            return True
+        return False
+
+    def cancel(self):
+        """Request cancellation and run the registered callbacks once."""
+        self._event.set()
+        self._run_callbacks()
+
+    def request_cancel(self):
+        """
+        Only set the flag; the callbacks run on the next `is_cancelled` check.
+        Safe in signal handlers, which may interrupt a thread holding the lock.
+        """
+        self._event.set()
+
+    def on_cancel(self, callback):
+        """
+        Register `callback` to run when the token is cancelled.
+        Returns a function that unregisters it again.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+
+                return unregister
+
+        callback()
+        return lambda: None
+
+    def _run_callbacks(self):
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
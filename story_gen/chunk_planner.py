@@ -0,0 +1,203 @@
+"""
+Cost-Model Chunk Planner for One-Shot Generation
+"""
+
+import math
+
+from .story_utils import (POLISH_NUM_CTX, POLISH_NUM_PREDICT, TOKENS_PER_WORD, NUM_PREDICT_HEADROOM,
+                          budget_num_predict)
+
+POLISH_PROMPT_TOKENS = 80
+
+
+class ChunkPlanner:
+    """
+    Plans one-shot chunk sizes that minimize total wall time.
+
+    One round (generate + polish) for a chunk of `n` output tokens costs about:
+
+        overhead + prompt_tokens * prefill_ms + n * decode_ms(context)     (generate)
+        overhead + n * prefill_ms + n * decode_ms(context)                 (polish)
+
+    where decode_ms grows linearly with the context length. Every extra chunk
+    pays the overhead and the prefill of the story tail again, while bigger
+    chunks decode more tokens at a longer context, so the best size sits
+    between the two. The rates start from rough priors and are refined from
+    the stats of each call with `observe`.
+    """
+
+    def __init__(self, max_words, num_ctx=6144, min_chunk=150, max_chunk=None,
+                 prefill_ms_per_token=0.6, decode_ms_per_token=25.0,
+                 decode_ms_per_ctx_token=0.00075, call_overhead_ms=250.0,
+                 tokens_per_word=TOKENS_PER_WORD, prompt_tokens=1200):
+        self.max_words = max_words
+        self.num_ctx = num_ctx
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+
+        self.prefill_ms = prefill_ms_per_token
+        self.decode_ms = decode_ms_per_token
+        self.decode_ms_per_ctx = decode_ms_per_ctx_token
+        self.overhead_ms = call_overhead_ms
+        self.tokens_per_word = tokens_per_word
+        self.prompt_tokens = prompt_tokens
+        # words delivered per word requested in the prompt
+        self.fill_ratio = 1.0
+
+        # running sums for fitting decode_ms = a + b * context
+        self._decode_fit = [0, 0.0, 0.0, 0.0, 0.0]
+
+    # ---- Cost model ----
+
+    def _decode_cost(self, tokens, start_ctx):
+        """Time to decode `tokens` tokens starting at a context of `start_ctx` tokens."""
+        mean_ctx = start_ctx + tokens / 2
+        return tokens * (self.decode_ms + self.decode_ms_per_ctx * mean_ctx)
+
+    def chunk_cost_ms(self, words):
+        """Estimated wall time of generating and polishing one chunk of `words` words."""
+        n = words * self.tokens_per_word
+        generate = (self.overhead_ms + self.prompt_tokens * self.prefill_ms
+                    + self._decode_cost(n, self.prompt_tokens))
+        polish_prompt = POLISH_PROMPT_TOKENS + n
+        polish = (self.overhead_ms + polish_prompt * self.prefill_ms
+                  + self._decode_cost(n, polish_prompt))
+        return generate + polish
+
+    def max_chunk_words(self):
+        """Largest chunk that fits the generate context and the polish budget."""
+        per_word = self.tokens_per_word
+        generate_limit = (self.num_ctx - self.prompt_tokens) / (per_word * NUM_PREDICT_HEADROOM)
+        polish_limit = min((POLISH_NUM_CTX - POLISH_PROMPT_TOKENS) / (2 * per_word),
+                           POLISH_NUM_PREDICT / per_word)
+        limit = int(min(generate_limit, polish_limit))
+        if self.max_chunk is not None:
+            limit = min(limit, self.max_chunk)
+        return max(self.min_chunk, limit)
+
+    def num_predict(self, words):
+        """Token cap for a generate call targeting `words` words."""
+        return budget_num_predict(words, self.tokens_per_word)
+
+    # ---- Planning ----
+
+    def best_chunk_count(self, words_remaining):
+        """Number of evenly sized chunks that minimizes the time to write `words_remaining` words."""
+        if words_remaining <= 0:
+            return 0
+
+        largest = self.max_chunk_words() * self.fill_ratio
+        fewest = max(1, math.ceil(words_remaining / largest))
+        most = max(fewest, math.ceil(words_remaining / self.min_chunk))
+
+        best_count, best_cost = fewest, None
+        for count in range(fewest, most + 1):
+            delivered = words_remaining / count
+            cost = count * self.chunk_cost_ms(delivered)
+            if best_cost is None or cost < best_cost:
+                best_count, best_cost = count, cost
+        return best_count
+
+    def schedule(self, words_done=0):
+        """
+        Plan the remaining chunks.
+
+        Returns a list of dicts with the words to request (`target`), the
+        expected words delivered (`words`), the `instruction` for the prompt,
+        `num_predict` and the estimated time `est_ms`.
+        """
+        words_remaining = self.max_words - words_done
+        count = self.best_chunk_count(words_remaining)
+
+        plan = []
+        position = words_done
+        for index in range(count):
+            words = words_remaining / count
+            target = min(self.max_chunk_words(), int(round(words / self.fill_ratio)))
+
+            if index == count - 1:
+                instruction = "final"
+            elif position >= 0.85 * self.max_words:
+                instruction = "conclusion"
+            else:
+                instruction = "continue"
+
+            plan.append({
+                "target": target,
+                "words": int(round(words)),
+                "instruction": instruction,
+                "num_predict": self.num_predict(target),
+                "est_ms": self.chunk_cost_ms(words),
+            })
+            position += words
+        return plan
+
+    def describe(self, plan):
+        """Human-readable lines for a planned schedule."""
+        total_s = sum(step["est_ms"] for step in plan) / 1000
+        lines = [f"[PLAN] {len(plan)} chunks, estimated {total_s:.0f}s "
+                 f"(prefill {self.prefill_ms:.2f} ms/tok, decode {self.decode_ms:.1f} ms/tok)"]
+        for number, step in enumerate(plan, 1):
+            lines.append(f"[PLAN]   {number}. ~{step['target']} words ({step['instruction']})")
+        return lines
+
+    # ---- Learning ----
+
+    def observe(self, stats, target=None, delivered_words=None):
+        """Update the rates from the stats dict of one call (see `parse_streamed_response`)."""
+        prompt_tokens = stats.get("prompt_tokens")
+        prompt_ms = stats.get("prompt_eval_ms")
+        # streams closed early carry no server timings; use the client-side ones
+        eval_ms = stats.get("eval_ms") or stats.get("stream_ms")
+        tokens = stats.get("tokens")
+        words = stats.get("words")
+
+        if prompt_tokens and prompt_ms:
+            self.prefill_ms = _ema(self.prefill_ms, prompt_ms / prompt_tokens)
+            if stats.get("kind") == "generate":
+                self.prompt_tokens = _ema(self.prompt_tokens, prompt_tokens)
+        elif stats.get("first_token_ms") and stats.get("prompt_words"):
+            # no server timings either: the time to the first token is about
+            # the call overhead plus the prefill of the (estimated) prompt
+            estimated_tokens = stats["prompt_words"] * self.tokens_per_word
+            prefill = stats["first_token_ms"] - self.overhead_ms
+            if prefill > 0:
+                self.prefill_ms = _ema(self.prefill_ms, prefill / estimated_tokens)
+            if stats.get("kind") == "generate":
+                self.prompt_tokens = _ema(self.prompt_tokens, estimated_tokens)
+
+        if tokens and eval_ms:
+            context = (prompt_tokens or self.prompt_tokens) + tokens / 2
+            self._fit_decode(context, eval_ms / tokens)
+
+        if tokens and words:
+            self.tokens_per_word = _ema(self.tokens_per_word, tokens / words)
+
+        wall_ms = stats.get("wall_ms")
+        if wall_ms and prompt_ms is not None and eval_ms is not None:
+            self.overhead_ms = _ema(self.overhead_ms, max(0.0, wall_ms - prompt_ms - eval_ms))
+
+        if target and delivered_words is not None:
+            self.fill_ratio = min(1.0, max(0.2, _ema(self.fill_ratio, delivered_words / target)))
+
+    def _fit_decode(self, context, ms_per_token):
+        fit = self._decode_fit
+        fit[0] += 1
+        fit[1] += context
+        fit[2] += ms_per_token
+        fit[3] += context * context
+        fit[4] += context * ms_per_token
+
+        count, sx, sy, sxx, sxy = fit
+        mean_x, mean_y = sx / count, sy / count
+        variance = sxx / count - mean_x * mean_x
+        if count >= 3 and variance > 1.0:
+            slope = (sxy / count - mean_x * mean_y) / variance
+            # keep the prior slope unless the fit is physically sensible
+            if 0 < slope and mean_y - slope * mean_x > 0:
+                self.decode_ms_per_ctx = slope
+        self.decode_ms = max(0.1, mean_y - self.decode_ms_per_ctx * mean_x)
+
+
+def _ema(old, new, alpha=0.5):
+    return (1 - alpha) * old + alpha * new
@@ -0,0 +1,128 @@
+"""
+Variant Fan-Out: One Caption, Many Genre/Setting Combinations
+
+All variants share the caption, a prewarmed model and one HTTP session.
+Identical seeded requests (e.g. variants that only differ in a setting the
+engine ignores) are sent once, and the stories run concurrently under a single
+in-flight request limit.
+"""
+
+import itertools
+import os
+import re
+
+from .story_utils import shared_requests, prewarm_model, run_parallel
+from .run_stats import RunStats
+from .generate_title import generate_title
+from tracer import span
+
+
+def build_variants(genres, creativity_levels=("balanced",), focus_modes=("balanced",),
+                   lengths=(1000,), consistency_modes=(False,)):
+    """
+    Expand genres x creativity x focus x length (x consistency) into variant
+    dicts, dropping duplicate combinations.
+    """
+    variants = []
+    seen = set()
+    for genre, creativity_level, focus_mode, max_words, consistency_mode in itertools.product(
+            genres, creativity_levels, focus_modes, lengths, consistency_modes):
+        genre = " ".join(genre.split())
+        key = (genre.lower(), creativity_level, focus_mode, int(max_words), bool(consistency_mode))
+        if not genre or key in seen:
+            continue
+        seen.add(key)
+        variants.append({
+            "genre": genre,
+            "creativity_level": creativity_level,
+            "focus_mode": focus_mode,
+            "max_words": int(max_words),
+            "consistency_mode": bool(consistency_mode),
+        })
+    return variants
+
+
+def variant_name(variant):
+    """File-system friendly name of a variant, e.g. `sci-fi_creative_dialogue_2000w`."""
+    genre = re.sub(r"[^a-z0-9]+", "-", variant["genre"].lower()).strip("-") or "general"
+    name = f"{genre}_{variant['creativity_level']}_{variant['focus_mode']}_{variant['max_words']}w"
+    return name + "_consistent" if variant["consistency_mode"] else name
+
+
+def generate_variants(caption, variants, engine="sequential", output_dir="fanout",
+                      max_parallel=3, seed=42, cancel_token=None, prewarm=True):
+    """
+    Generate one story per variant from a shared caption.
+
+    Each story is written to `<output_dir>/<variant name>.txt` and an
+    `index.txt` lists all variants. Returns one result dict per variant with
+    `variant`, `name`, `title`, `story`, `path`, `stats` (a `RunStats`) and
+    `error`; a failing variant gets its `error` set and does not stop the others.
+    """
+    from . import ONE_SHOT_ENGINES
+
+    if not caption:
+        raise ValueError("Caption must not be empty.")
+
+    generate = ONE_SHOT_ENGINES[engine] if isinstance(engine, str) else engine
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"[INFO] Fanning out {len(variants)} variants, {max_parallel} at a time...")
+    if prewarm:
+        prewarm_model()
+
+    def run_variant(variant):
+        name = variant_name(variant)
+        run_stats = RunStats()
+        print(f"[VARIANT] Starting {name}...")
+        try:
+            return generate_variant(variant, name, run_stats)
+        except Exception as e:
+            print(f"[ERROR] Variant {name} failed: {e}")
+            return {"variant": variant, "name": name, "title": None, "story": "",
+                    "path": None, "stats": run_stats, "error": str(e) or type(e).__name__}
+
+    def generate_variant(variant, name, run_stats):
+        story = generate(
+            caption=caption,
+            genre=variant["genre"],
+            max_words=variant["max_words"],
+            creativity_level=variant["creativity_level"],
+            consistency_mode=variant["consistency_mode"],
+            focus_mode=variant["focus_mode"],
+            output_file=os.path.join(output_dir, f"{name}.progress.txt"),
+            cancel_token=cancel_token,
+            run_stats=run_stats,
+            seed=seed,
+        )
+        title = generate_title(story, variant["genre"], cancel_token=cancel_token, choose=False)
+
+        path = os.path.join(output_dir, f"{name}.txt")
+        with span("file.write", "io", path=path), open(path, 'w', encoding='utf-8') as f:
+            f.write(f"[TITLE]\n{title}\n\n")
+            f.write("[CAPTION]\n")
+            f.write(caption + "\n")
+            f.write("\n" + "="*30 + "\n\n")
+            f.write(f"[STORY] (Genre: {variant['genre']})\n")
+            f.write(story)
+
+        print(f"[VARIANT] {name} done: {len(story.split())} words, '{title}'")
+        return {"variant": variant, "name": name, "title": title, "story": story,
+                "path": path, "stats": run_stats, "error": None}
+
+    with shared_requests(max_in_flight=max_parallel) as cache:
+        results = run_parallel(run_variant, variants, max_parallel, cancel_token)
+
+    index_path = os.path.join(output_dir, "index.txt")
+    with span("file.write", "io", path=index_path), open(index_path, 'w', encoding='utf-8') as f:
+        f.write(f"[CAPTION]\n{caption}\n\n")
+        for result in results:
+            if result["error"]:
+                f.write(f"{result['name']}\tFAILED\t{result['error']}\n")
+            else:
+                f.write(f"{result['name']}\t{len(result['story'].split())} words\t{result['title']}\n")
+
+    failed = sum(1 for result in results if result["error"])
+    print(f"[INFO] Fan-out complete: {len(results) - failed} stories in '{output_dir}', {failed} failed, "
+          f"{cache.hits} duplicate requests shared.")
+    return results
@@ -1,9 +1,17 @@
-import requests
+from .story_utils import stream_generate
+from tracer import span
 
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
+DEFAULT_TITLE = "Untitled Story"
+
+def generate_title(story_text, genre="General", cancel_token=None, choose=True):
+    """
+    Generate multiple title options for the story and let the user choose.
+    With `choose=False` the first option is taken without prompting.
+    """
+    if cancel_token is not None and cancel_token.is_cancelled():
+        print("[INFO] Generation cancelled, skipping title generation.")
+        return DEFAULT_TITLE
 
-def generate_title(story_text, genre="General"):
-    """Generate multiple title options for the story and let the user choose."""
     payload = {
         "model": "llama3.1:8b",
         "prompt": (
@@ -12,20 +20,15 @@ def generate_title(story_text, genre="General"):
             "Avoid generic titles. Make them intriguing and genre-appropriate. Number each option clearly.\n\n"
             f"Story:\n{story_text}\n\nTitle options:"
         ),
-        "stream": False
+        "stream": True
     }
 
     print("[INFO] Generating title options for the story...")
-    response = requests.post(OLLAMA_API_URL, json=payload)
-    response.raise_for_status()
-
-    titles_block = response.json().get("response", "").strip()
+    titles_block = stream_generate(payload, cancel_token, kind="title")
 
-    # title options
-    print("\nHere are the title options:\n")
-    print(titles_block)
-    print("\nPlease choose a title by entering its number (e.g., 1, 2, 3, etc.):")
-    choice = input("Your choice: ").strip()
+    if cancel_token is not None and cancel_token.is_cancelled():
+        print("[INFO] Generation cancelled, skipping title generation.")
+        return DEFAULT_TITLE
 
     # title list
     titles = []
@@ -34,10 +37,20 @@ def generate_title(story_text, genre="General"):
             title = line.split(".", 1)[1].strip(" \"")
             titles.append(title)
 
+    if not choose:
+        return titles[0] if titles else DEFAULT_TITLE
+
+    # title options
+    print("\nHere are the title options:\n")
+    print(titles_block)
+    print("\nPlease choose a title by entering its number (e.g., 1, 2, 3, etc.):")
+    with span("input.blocked", "input", prompt="title choice"):
+        choice = input("Your choice: ").strip()
+
     try:
         chosen_title = titles[int(choice) - 1]
     except (IndexError, ValueError):
         print("[WARNING] Invalid choice. Defaulting to the first title.")
-        chosen_title = titles[0] if titles else "Untitled Story"
+        chosen_title = titles[0] if titles else DEFAULT_TITLE
 
     return chosen_title
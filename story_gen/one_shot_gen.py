@@ -2,17 +2,25 @@
 One-Shot Story Generation Logic with Progress Saving
 """
 
-from .story_utils import polish_chunk, parse_streamed_response, get_generation_params, OLLAMA_API_URL
-import requests
-import json
+from .story_utils import polish_chunk, generate_chunk, get_generation_params
+from .run_stats import RunStats
+from .chunk_planner import ChunkPlanner
+from tracer import span
 
 def generate_one_shot_story(caption, genre="General", max_words=5000, 
                              creativity_level="balanced", output_file="results.txt",
-                             chunk_size=800, max_attempts=20,
-                             consistency_mode=False, focus_mode="balanced"):
+                             chunk_size=None, max_attempts=None,
+                             consistency_mode=False, focus_mode="balanced",
+                             cancel_token=None, run_stats=None, num_ctx=6144, planner=None, seed=None):
     """
     Generate a full-length story by stitching together multiple chunks.
     Progress is saved iteratively to a file after each chunk.
+    If `cancel_token` is cancelled, the story generated so far is returned.
+    Each chunk stream except the ending is closed at the first sentence boundary past its word target.
+
+    Chunk sizes come from a `ChunkPlanner` (`chunk_size` caps them). The plan is
+    printed before generation starts and revised after every chunk from the
+    measured call stats. A fixed `seed` makes the requests reproducible.
     """
     temperature, top_p, repeat_penalty, top_k = get_generation_params(
         creativity_level,
@@ -23,32 +31,32 @@ def generate_one_shot_story(caption, genre="General", max_words=5000,
     if not caption:
         raise ValueError("Caption must not be empty.")
 
+    run_stats = run_stats if run_stats is not None else RunStats()
+    planner = planner or ChunkPlanner(max_words, num_ctx=num_ctx, max_chunk=chunk_size)
+    plan = planner.schedule()
+    if max_attempts is None:
+        max_attempts = 2 * len(plan) + 2
     total_words_generated = 0
     chunk_count = 0
     story = ""
 
     # Clear previous file if exists
-    with open(output_file, 'w', encoding='utf-8') as f:
+    with span("file.write", "io", path=output_file), open(output_file, 'w', encoding='utf-8') as f:
         f.write(f"Story Generation Progress\n{'='*30}\n\n")
 
     print(f"[INFO] Starting one-shot story generation...")
-    print(f"[INFO] Target: {max_words} words, Chunk size: ~{chunk_size} words")
+    print(f"[INFO] Target: {max_words} words, Context: {num_ctx} tokens")
+    for line in planner.describe(plan):
+        print(line)
 
     while total_words_generated < max_words and chunk_count < max_attempts:
+        if cancel_token is not None and cancel_token.is_cancelled():
+            break
+
         chunk_count += 1
-        words_remaining = max_words - total_words_generated
-        
-        nearing_end = total_words_generated >= 0.85 * max_words
-        
-        if nearing_end:
-            current_chunk_target = min(words_remaining, chunk_size // 2)
-            generation_instruction = "conclusion"
-        elif words_remaining < chunk_size:
-            current_chunk_target = words_remaining
-            generation_instruction = "final"
-        else:
-            current_chunk_target = chunk_size
-            generation_instruction = "continue"
+        step = plan[0]
+        current_chunk_target = step["target"]
+        generation_instruction = step["instruction"]
 
         prompt = _build_prompt(caption, genre, story, current_chunk_target, generation_instruction, focus_mode)
 
@@ -61,24 +69,32 @@ def generate_one_shot_story(caption, genre="General", max_words=5000,
                 "top_p": top_p,
                 "top_k": top_k,
                 "repeat_penalty": repeat_penalty,
-                "num_ctx": 6144,
-                "num_predict": current_chunk_target + 200,
+                "num_ctx": num_ctx,
+                "num_predict": step["num_predict"],
                 "stop": ["THE END", "End of story", "---"] if generation_instruction == "final" else [],
             }
         }
+        if seed is not None:
+            payload["options"]["seed"] = seed
 
         print(f"[CHUNK {chunk_count}] Generating ~{current_chunk_target} words ({generation_instruction})...")
-        response = requests.post(OLLAMA_API_URL, json=payload, stream=True)
-        response.raise_for_status()
-
-        story_chunk = parse_streamed_response(response)
-        polished_chunk = polish_chunk(story_chunk.strip(), creativity_level)
+        generate_stats, polish_stats = {}, {}
+        # endings are bounded by num_predict and the stop strings, not cut at the word budget
+        word_budget = None if generation_instruction in ("final", "conclusion") else step["words"]
+        story_chunk = generate_chunk(payload, story, cancel_token, word_budget, run_stats, stats=generate_stats)
+        polished_chunk = polish_chunk(story_chunk.strip(), creativity_level, cancel_token, run_stats,
+                                      stats=polish_stats, seed=seed)
+
+        if not polished_chunk and cancel_token is not None and cancel_token.is_cancelled():
+            print("[INFO] Generation cancelled, keeping the story produced so far.")
+            break
 
         # Save after every polished chunk
-        with open(output_file, 'a', encoding='utf-8') as f:
+        with span("file.write", "io", path=output_file), open(output_file, 'a', encoding='utf-8') as f:
             f.write(polished_chunk + "\n\n")
 
         story += "\n\n" + polished_chunk if story else polished_chunk
+        run_stats.add_chunk(polished_chunk)
         total_words_generated = len(story.split())
 
         print(f"[PROGRESS] {total_words_generated}/{max_words} words ({(total_words_generated / max_words) * 100:.1f}%)")
@@ -86,10 +102,20 @@ def generate_one_shot_story(caption, genre="General", max_words=5000,
         if total_words_generated >= max_words:
             print(f"[SUCCESS] Target word count reached!")
             break
-        
-        if chunk_count > 1 and len(polished_chunk.split()) < 50:
-            print(f"[WARNING] Chunk {chunk_count} generated only {len(polished_chunk.split())} words")
 
+        if cancel_token is not None and cancel_token.is_cancelled():
+            print("[INFO] Generation cancelled, keeping the story produced so far.")
+            break
+
+        # learn from this chunk and re-plan the rest
+        chunk_words = len(polished_chunk.split())
+        planner.observe(generate_stats, current_chunk_target, chunk_words)
+        planner.observe(polish_stats)
+        if chunk_words < 0.6 * step["words"]:
+            print(f"[WARNING] Chunk {chunk_count} came back short ({chunk_words}/{step['words']} words), re-planning...")
+        plan = planner.schedule(total_words_generated)
+
+    print(f"[INFO] {run_stats.summary()}")
     return story
 
 
@@ -0,0 +1,291 @@
+"""
+Outline-Then-Expand One-Shot Story Generation
+
+The story is first planned as an outline with per-section summaries and
+continuity notes. Sections are then expanded concurrently (bounded by
+`max_parallel` in-flight requests) and a final pass smooths the opening of
+each section into the ending of the previous one.
+"""
+
+import re
+import threading
+
+from .story_utils import polish_chunk, stream_generate, generate_chunk, get_generation_params, run_parallel
+from .run_stats import RunStats
+from .chunk_planner import ChunkPlanner
+from .one_shot_gen import generate_one_shot_story
+from tracer import span
+
+SEAM_TAIL_CHARS = 1200
+# outlines with more than this many times the requested sections are cut down
+MAX_EXTRA_SECTIONS = 1.5
+
+
+def generate_outline_story(caption, genre="General", max_words=5000,
+                           creativity_level="balanced", output_file="results.txt",
+                           consistency_mode=False, focus_mode="balanced",
+                           cancel_token=None, run_stats=None, num_ctx=6144,
+                           planner=None, max_parallel=3, seed=None):
+    """
+    Generate a full-length story from an outline whose sections are written in parallel.
+    Falls back to `generate_one_shot_story` if the outline cannot be parsed.
+
+    The Ollama server only decodes requests concurrently when OLLAMA_NUM_PARALLEL
+    allows it; otherwise the requests queue and this behaves like the sequential engine.
+    A fixed `seed` makes the requests reproducible. Each section is appended to
+    `output_file` as soon as it is written.
+    """
+    if not caption:
+        raise ValueError("Caption must not be empty.")
+
+    params = get_generation_params(creativity_level, consistency_mode=consistency_mode, one_shot_mode=True)
+    run_stats = run_stats if run_stats is not None else RunStats()
+    planner = planner or ChunkPlanner(max_words, num_ctx=num_ctx)
+
+    section_count = max(2, planner.best_chunk_count(max_words))
+    section_words = max_words // section_count
+
+    # Clear previous file if exists
+    with span("file.write", "io", path=output_file), open(output_file, 'w', encoding='utf-8') as f:
+        f.write(f"Story Generation Progress\n{'='*30}\n\n")
+
+    print(f"[INFO] Starting outline story generation...")
+    print(f"[INFO] Target: {max_words} words in {section_count} sections of ~{section_words} words, "
+          f"{max_parallel} in parallel")
+
+    outline = _generate_outline(caption, genre, section_count, params, num_ctx, seed, cancel_token, run_stats)
+    if cancel_token is not None and cancel_token.is_cancelled():
+        return ""
+    if len(outline["sections"]) < 2:
+        print("[WARNING] Could not parse the outline, falling back to sequential generation.")
+        return generate_one_shot_story(
+            caption, genre=genre, max_words=max_words, creativity_level=creativity_level,
+            output_file=output_file, consistency_mode=consistency_mode, focus_mode=focus_mode,
+            cancel_token=cancel_token, run_stats=run_stats, num_ctx=num_ctx, planner=planner, seed=seed
+        )
+
+    if len(outline["sections"]) > MAX_EXTRA_SECTIONS * section_count:
+        print(f"[WARNING] Outline has {len(outline['sections'])} sections instead of {section_count}, "
+              f"keeping the first {section_count}.")
+        outline["sections"] = outline["sections"][:section_count]
+    # the model may not have written exactly `section_count` sections
+    section_words = min(max_words // len(outline["sections"]), planner.max_chunk_words())
+    if len(outline["sections"]) != section_count:
+        print(f"[INFO] Writing {len(outline['sections'])} sections of ~{section_words} words.")
+
+    for number, section in enumerate(outline["sections"], 1):
+        print(f"[OUTLINE] {number}. {section['title']}")
+
+    write_lock = threading.Lock()
+
+    def expand(index):
+        section = _expand_section(index, outline, caption, genre, section_words, focus_mode,
+                                  creativity_level, params, planner, num_ctx, seed, cancel_token, run_stats)
+        # Save every section as soon as it is written (in completion order)
+        if section:
+            with write_lock, span("file.write", "io", path=output_file), \
+                    open(output_file, 'a', encoding='utf-8') as f:
+                f.write(f"[SECTION {index + 1}: {outline['sections'][index]['title']}]\n{section}\n\n")
+        return section
+
+    sections = run_parallel(expand, range(len(outline["sections"])), max_parallel, cancel_token)
+
+    def smooth(index):
+        return _smooth_seam(sections[index - 1], sections[index], params, seed, cancel_token, run_stats)
+
+    if not (cancel_token is not None and cancel_token.is_cancelled()):
+        print("[INFO] Smoothing transitions between sections...")
+        openings = run_parallel(smooth, range(1, len(sections)), max_parallel, cancel_token)
+        for index, opening in enumerate(openings, 1):
+            sections[index] = opening
+
+    for section in sections:
+        if section:
+            run_stats.add_chunk(section)
+    story = "\n\n".join(section for section in sections if section)
+
+    # Replace the per-section progress with the smoothed story in order
+    with span("file.write", "io", path=output_file), open(output_file, 'w', encoding='utf-8') as f:
+        f.write(f"Story Generation Progress\n{'='*30}\n\n")
+        f.write(story + "\n\n")
+
+    print(f"[PROGRESS] {len(story.split())}/{max_words} words")
+    print(f"[INFO] {run_stats.summary()}")
+    return story
+
+
+# ---- Helper functions ----
+
+def _generate_outline(caption, genre, section_count, params, num_ctx, seed, cancel_token, run_stats):
+    temperature, top_p, repeat_penalty, top_k = params
+
+    prompt = (
+        f"You are a critically acclaimed novelist planning a {genre} story based on this description:\n"
+        f"\"{caption}\"\n\n"
+        f"Write an outline with exactly {section_count} sections. The last section must resolve the story. "
+        f"Use exactly this format and nothing else:\n\n"
+        f"CHARACTERS: <main characters, one short description each>\n"
+        f"SECTION 1: <section title>\n"
+        f"SUMMARY: <2-3 sentences describing what happens>\n"
+        f"CONTINUITY: <names, places, objects and open threads later sections must respect>\n"
+        f"SECTION 2: <section title>\n"
+        f"...\n\n"
+        f"Outline:"
+    )
+
+    payload = {
+        "model": "llama3.1:8b",
+        "prompt": prompt,
+        "stream": True,
+        "options": {
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "repeat_penalty": repeat_penalty,
+            "num_ctx": num_ctx,
+            "num_predict": 150 * section_count + 200,
+        }
+    }
+    if seed is not None:
+        payload["options"]["seed"] = seed
+
+    print(f"[OUTLINE] Planning {section_count} sections...")
+    text = stream_generate(payload, cancel_token, run_stats=run_stats, kind="outline")
+    return _parse_outline(text)
+
+
+def _parse_outline(text):
+    """Parse the outline text into characters and a list of sections."""
+    characters = ""
+    match = re.search(r"^\s*\**CHARACTERS\**\s*:\s*(.+?)(?=^\s*\**SECTION\b|\Z)", text, re.S | re.M | re.I)
+    if match:
+        characters = " ".join(match.group(1).split())
+
+    sections = []
+    blocks = re.split(r"^\s*\**SECTION\s+\d+\**\s*:?\s*", text, flags=re.M | re.I)[1:]
+    for block in blocks:
+        title, _, body = block.partition("\n")
+        summary = _field(body, "SUMMARY")
+        continuity = _field(body, "CONTINUITY")
+        if not summary:
+            continue
+        sections.append({
+            "title": title.strip(" *\"") or f"Part {len(sections) + 1}",
+            "summary": summary,
+            "continuity": continuity,
+        })
+
+    return {"characters": characters, "sections": sections}
+
+
+def _field(body, name):
+    match = re.search(rf"^\s*\**{name}\**\s*:\s*(.+?)(?=^\s*\**[A-Z]+\**\s*:|\Z)", body, re.S | re.M | re.I)
+    return " ".join(match.group(1).split()) if match else ""
+
+
+def _expand_section(index, outline, caption, genre, section_words, focus_mode, creativity_level,
+                    params, planner, num_ctx, seed, cancel_token, run_stats):
+    temperature, top_p, repeat_penalty, top_k = params
+    sections = outline["sections"]
+
+    prompt = _build_section_prompt(index, outline, caption, genre, section_words, focus_mode)
+    payload = {
+        "model": "llama3.1:8b",
+        "prompt": prompt,
+        "stream": True,
+        "options": {
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "repeat_penalty": repeat_penalty,
+            "num_ctx": num_ctx,
+            "num_predict": planner.num_predict(section_words),
+            "stop": ["THE END", "End of story", "---"] if index == len(sections) - 1 else [],
+        }
+    }
+    if seed is not None:
+        payload["options"]["seed"] = seed
+
+    print(f"[SECTION {index + 1}] Generating ~{section_words} words...")
+    # the last section is bounded by num_predict and the stop strings, not cut at the word budget
+    word_budget = None if index == len(sections) - 1 else section_words
+    section = generate_chunk(payload, "", cancel_token, word_budget, run_stats)
+    polished = polish_chunk(section.strip(), creativity_level, cancel_token, run_stats, seed=seed)
+    print(f"[SECTION {index + 1}] Done ({len(polished.split())} words)")
+    return polished
+
+
+def _build_section_prompt(index, outline, caption, genre, section_words, focus_mode):
+    focus_instructions = {
+        "descriptive": "Focus on vivid descriptions and sensory details.",
+        "dialogue": "Emphasize character interactions and dialogue.",
+        "action": "Focus on dynamic scenes and plot progression.",
+        "balanced": "Balance description, dialogue, and action."
+    }
+    focus_text = focus_instructions.get(focus_mode, "Balance description, dialogue, and action.")
+
+    sections = outline["sections"]
+    section = sections[index]
+    overview = "\n".join(f"{number}. {s['title']}: {s['summary']}" for number, s in enumerate(sections, 1))
+    continuity = "\n".join(f"- {s['continuity']}" for s in sections[:index + 1] if s["continuity"])
+
+    if index == 0:
+        position = "Begin the story. Do not write anything past this section."
+    elif index == len(sections) - 1:
+        position = (f"Pick up right after section {index}: {sections[index - 1]['summary']}\n"
+                    f"Bring the story to a satisfying, coherent ending.")
+    else:
+        position = (f"Pick up right after section {index}: {sections[index - 1]['summary']}\n"
+                    f"Stop before section {index + 2}: {sections[index + 1]['summary']}")
+
+    return (
+        f"You are a critically acclaimed novelist writing section {index + 1} of {len(sections)} "
+        f"of a {genre} story. Write approximately {section_words} words for this section only.\n\n"
+        f"{focus_text}\n\n"
+        f"Description: \"{caption}\"\n\n"
+        f"Characters: {outline['characters'] or 'As established in the outline.'}\n\n"
+        f"Outline:\n{overview}\n\n"
+        f"Continuity notes:\n{continuity or '- None yet.'}\n\n"
+        f"{position}\n\n"
+        f"Section {index + 1} - {section['title']}: {section['summary']}\n\n"
+        f"Write section {index + 1}:"
+    )
+
+
+def _smooth_seam(previous_section, section, params, seed, cancel_token, run_stats):
+    """
+    Rewrite the opening paragraph of `section` so it follows on from the end of
+    `previous_section`. Only the opening is rewritten, so all seams can run in parallel.
+    """
+    temperature, top_p, repeat_penalty, top_k = params
+    paragraphs = section.split("\n\n")
+    if not previous_section or not paragraphs[0].strip():
+        return section
+
+    opening = paragraphs[0]
+    payload = {
+        "model": "llama3.1:8b",
+        "prompt": (
+            "You are a professional novel editor. Rewrite the OPENING paragraph so it flows naturally "
+            "from the PREVIOUS ENDING: smooth the transition, remove repeated events and keep names and "
+            "facts consistent. Keep about the same length. Output ONLY the rewritten paragraph "
+            "WITHOUT any explanation.\n\n"
+            f"PREVIOUS ENDING:\n{previous_section[-SEAM_TAIL_CHARS:]}\n\n"
+            f"OPENING:\n{opening}\n\nRewritten opening:"
+        ),
+        "stream": True,
+        "options": {
+            "temperature": min(temperature, 0.6),
+            "top_p": top_p,
+            "repeat_penalty": repeat_penalty,
+            "num_ctx": 4096,
+            "num_predict": int(len(opening.split()) * 2) + 50,
+        }
+    }
+    if seed is not None:
+        payload["options"]["seed"] = seed
+
+    rewritten = stream_generate(payload, cancel_token, run_stats=run_stats, kind="seam")
+    if not rewritten or (cancel_token is not None and cancel_token.is_cancelled()):
+        return section
+    return "\n\n".join([rewritten] + paragraphs[1:])
@@ -0,0 +1,131 @@
+"""
+Streaming repetition and degeneration detection.
+"""
+
+from collections import deque
+
+_MODULUS = (1 << 61) - 1
+_BASE = 1_000_003
+_STRIP = ".,;:!?\"'()[]*-“”‘’—…"
+
+
+class RepetitionDetector:
+    """
+    Detects a generation that has started looping, one streamed fragment at a time.
+
+    Every completed word extends a rolling hash of the last `n` words. Each
+    n-gram hash is looked up in a set seeded from the recent story and grown
+    with the text of the current chunk, so both "repeat the previous chunk"
+    and "repeat my own last paragraph" loops are caught. The score is the share
+    of repeated n-grams among the last `window` ones, kept as a running sum, so
+    the cost per word is constant.
+    """
+
+    def __init__(self, context="", n=6, window=40, threshold=0.6, context_words=1500):
+        self.n = n
+        self.window = window
+        self.threshold = threshold
+
+        self._seen = set()
+        self._recent = deque()
+        self._hash = 0
+        self._drop_factor = pow(_BASE, n - 1, _MODULUS)
+        self._hits = deque()
+        self._hit_count = 0
+
+        # char offset / token index of the first word of each n-gram in the hash
+        self._starts = deque()
+        self._run_start = None
+        self._offset = 0
+        self._word = []
+        self._word_start = None
+
+        words = context.split()[-context_words:]
+        # identifies the seeded context, e.g. for caching identical requests
+        self.context_key = hash(tuple(words))
+        for word in words:
+            key = self._push(word)
+            if key is not None:
+                self._seen.add(key)
+        self._recent.clear()
+        self._hash = 0
+
+    @property
+    def score(self):
+        return self._hit_count / self.window
+
+    def feed(self, fragment, token_index=0):
+        """Consume the next streamed fragment. Returns True once the text is degenerate."""
+        degenerate = False
+        for char in fragment:
+            if char.isspace():
+                if self._word:
+                    degenerate = self._end_word(token_index) or degenerate
+            else:
+                if not self._word:
+                    self._word_start = (self._offset, token_index)
+                self._word.append(char)
+            self._offset += 1
+        return degenerate
+
+    def trim_offset(self, text):
+        """
+        Char offset at which to cut `text` to drop the repeated tail: the last
+        sentence boundary before the repetition run started.
+        """
+        if self._run_start is None:
+            return len(text)
+        cut = self._run_start[0]
+        boundary = max(text.rfind(mark, 0, cut) for mark in (".", "!", "?"))
+        return boundary + 1 if boundary >= 0 else cut
+
+    def aborted_tokens(self, tokens):
+        """Tokens streamed since the repetition run started."""
+        if self._run_start is None:
+            return 0
+        return max(0, tokens - self._run_start[1])
+
+    # ---- Internals ----
+
+    def _push(self, word):
+        """Add a word to the rolling hash; returns the n-gram hash once n words are in."""
+        word = word.lower().strip(_STRIP)
+        if not word:
+            return None
+        word_hash = hash(word) % _MODULUS
+
+        if len(self._recent) == self.n:
+            oldest = self._recent.popleft()
+            self._hash = (self._hash - oldest * self._drop_factor) % _MODULUS
+        self._recent.append(word_hash)
+        self._hash = (self._hash * _BASE + word_hash) % _MODULUS
+
+        return self._hash if len(self._recent) == self.n else None
+
+    def _end_word(self, token_index):
+        word = "".join(self._word)
+        self._word = []
+        if self._push(word) is None:
+            if word.strip(_STRIP):
+                self._starts.append(self._word_start)
+            return False
+
+        self._starts.append(self._word_start)
+        while len(self._starts) > self.n:
+            self._starts.popleft()
+
+        key = self._hash
+        repeated = key in self._seen
+        self._seen.add(key)
+
+        self._hits.append(repeated)
+        self._hit_count += repeated
+        if len(self._hits) > self.window:
+            self._hit_count -= self._hits.popleft()
+
+        if self._hit_count == 0:
+            self._run_start = None
+        elif repeated and self._run_start is None:
+            self._run_start = self._starts[0]
+
+        return len(self._hits) == self.window and self.score >= self.threshold
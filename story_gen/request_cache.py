@@ -0,0 +1,67 @@
+"""
+Sharing of identical seeded generate requests.
+"""
+
+import json
+import threading
+from concurrent.futures import Future
+
+
+def is_seeded(payload):
+    """True if the payload fixes its sampling seed, so identical requests give identical output."""
+    seed = payload.get("options", {}).get("seed")
+    return seed is not None and seed != -1
+
+
+def request_key(payload, word_budget=None, detector=None):
+    """Cache key of one generate call: payload plus everything that shapes the parsed result."""
+    return json.dumps({
+        "payload": payload,
+        "word_budget": word_budget,
+        "detector": detector.context_key if detector is not None else None,
+    }, sort_keys=True)
+
+
+class RequestCache:
+    """
+    Results of seeded generate calls, keyed by `request_key`.
+
+    Concurrent identical requests wait for the one already in flight instead
+    of being sent again. Failed or cancelled calls are not kept.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def get_or_compute(self, key, compute):
+        """
+        Return `(result, hit)` where `result` comes from `compute()` or an earlier call.
+        `compute` returns `(result, keep)`; results with `keep=False` are not cached.
+        """
+        with self._lock:
+            future = self._entries.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._entries[key] = future
+            else:
+                self.hits += 1
+
+        if not owner:
+            return future.result(), True
+
+        try:
+            result, keep = compute()
+        except BaseException as exc:
+            with self._lock:
+                self._entries.pop(key, None)
+            future.set_exception(exc)
+            raise
+
+        if not keep:
+            with self._lock:
+                self._entries.pop(key, None)
+        future.set_result(result)
+        return result, False
@@ -0,0 +1,83 @@
+"""
+Per-run generation statistics.
+"""
+
+import threading
+
+
+class RunStats:
+    """
+    Collects one stats dict per model call made while generating a story,
+    and the final text of each story chunk in `chunks`.
+
+    Each call dict is filled by `parse_streamed_response` and contains at least
+    `kind`, `tokens`, `words` and `stopped_early`; calls cut short by the word
+    budget or the repetition detector also carry `tokens_saved` (an upper
+    bound: the unused part of the num_predict cap), and looping calls record
+    the repeated tokens they dropped in `aborted_tokens`. Calls answered from
+    the shared request cache are marked `cached` and count towards no total
+    except `cached_calls`.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.chunks = []
+        self._lock = threading.Lock()
+
+    def record(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def add_chunk(self, text):
+        with self._lock:
+            self.chunks.append(text)
+
+    @property
+    def streamed_calls(self):
+        """Calls actually sent to the model, i.e. not answered from the request cache."""
+        return [call for call in self.calls if not call.get("cached")]
+
+    @property
+    def tokens_saved(self):
+        return sum(call.get("tokens_saved", 0) for call in self.streamed_calls)
+
+    @property
+    def early_stops(self):
+        return sum(1 for call in self.streamed_calls if call.get("stopped_early"))
+
+    @property
+    def cached_calls(self):
+        return sum(1 for call in self.calls if call.get("cached"))
+
+    @property
+    def tokens(self):
+        return sum(call.get("tokens", 0) for call in self.streamed_calls)
+
+    @property
+    def aborted_tokens(self):
+        return sum(call.get("aborted_tokens", 0) for call in self.streamed_calls)
+
+    @property
+    def degenerate_calls(self):
+        return sum(1 for call in self.streamed_calls if call.get("degenerate"))
+
+    def as_dict(self):
+        """Totals of the run, for storing alongside the story."""
+        return {
+            "calls": len(self.calls),
+            "cached_calls": self.cached_calls,
+            "tokens": self.tokens,
+            "wall_ms": sum(call.get("wall_ms", 0) for call in self.streamed_calls),
+            "tokens_saved": self.tokens_saved,
+            "early_stops": self.early_stops,
+            "aborted_tokens": self.aborted_tokens,
+            "degenerate_calls": self.degenerate_calls,
+        }
+
+    def summary(self):
+        """One-line summary of the run for the console."""
+        return (
+            f"{len(self.calls)} model calls ({self.cached_calls} shared), {self.tokens:,} tokens streamed, "
+            f"up to {self.tokens_saved:,} tokens saved by {self.early_stops} early stops, "
+            f"{self.aborted_tokens:,} repeated tokens dropped from {self.degenerate_calls} looping calls"
+        )
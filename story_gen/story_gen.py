@@ -2,18 +2,20 @@
 Enhanced Story Generation Logic with Controlled Creativity and Focus Modes
 """
 
-from .story_utils import polish_chunk, parse_streamed_response, get_generation_params, OLLAMA_API_URL
-import requests
+from .story_utils import polish_chunk, generate_chunk, get_generation_params, budget_num_predict
 
 def generate_story(caption, genre="General", current_story="", user_instruction="", 
                    max_chunk_words=500, nearing_end=False, ending=False, 
-                   creativity_level="balanced", consistency_mode=False, focus_mode="balanced"):
+                   creativity_level="balanced", consistency_mode=False, focus_mode="balanced",
+                   cancel_token=None, run_stats=None):
     """
     Generate story chunks with enhanced control parameters.
+    If `cancel_token` is cancelled, the text generated so far is returned unpolished.
+    Non-ending chunks stop streaming at the first sentence boundary past `max_chunk_words`.
     """
     temperature, top_p, repeat_penalty, top_k = get_generation_params(creativity_level, consistency_mode=consistency_mode)
 
-    num_predict, num_ctx = _adjust_context_and_length(current_story, ending)
+    num_predict, num_ctx = _adjust_context_and_length(current_story, ending, max_chunk_words)
 
     prompt = _build_prompt(caption, genre, current_story, user_instruction, 
                            max_chunk_words, nearing_end, ending, focus_mode)
@@ -37,23 +39,27 @@ def generate_story(caption, genre="General", current_story="", user_instruction=
     print(f"[INFO] Generating story chunk with {creativity_level} creativity, {focus_mode} focus...")
     print(f"[INFO] Parameters: temp={temperature:.2f}, top_p={top_p:.2f}, repeat_penalty={repeat_penalty:.2f}")
     
-    response = requests.post(OLLAMA_API_URL, json=payload, stream=True)
-    response.raise_for_status()
+    word_budget = None if ending else max_chunk_words
+    story_chunk = generate_chunk(payload, current_story, cancel_token, word_budget, run_stats)
 
-    story_chunk = parse_streamed_response(response)
+    if cancel_token is not None and cancel_token.is_cancelled():
+        print("[INFO] Generation cancelled, keeping the text produced so far.")
+        return story_chunk
 
-    return polish_chunk(story_chunk, creativity_level)
+    return polish_chunk(story_chunk, creativity_level, cancel_token, run_stats)
 
 
 # ---- Helper functions ----
 
-def _adjust_context_and_length(current_story, ending):
+def _adjust_context_and_length(current_story, ending, max_chunk_words):
+    # non-ending chunks are capped just above the word budget, so they end
+    # on the client-side sentence-boundary stop rather than mid-sentence
     if ending:
         return 800, 8192
     elif not current_story:
-        return 700, 4096
+        return budget_num_predict(max_chunk_words), 4096
     else:
-        return 600, 6144
+        return budget_num_predict(max_chunk_words), 6144
 
 
 def _build_prompt(caption, genre, current_story, user_instruction, max_chunk_words, nearing_end, ending, focus_mode):
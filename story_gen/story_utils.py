@@ -2,17 +2,115 @@
 Common utilities for story generation modules.
 """
 
-import requests
 import json
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from tracer import span
+from .repetition import RepetitionDetector
+from .request_cache import RequestCache, is_seeded, request_key
 
 # API endpoint for Ollama server
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
 
+# Context and output limits of the polishing pass
+POLISH_NUM_CTX = 4096
+POLISH_NUM_PREDICT = 1000
+
+# Rough tokens per English word, and the margin a word-budgeted request gets
+# on top of it so the client-side sentence-boundary stop is reached before
+# the server's num_predict cap
+TOKENS_PER_WORD = 1.35
+NUM_PREDICT_HEADROOM = 1.15
+
+# repeat_penalty increase for the retry of a looping generation
+REPEAT_PENALTY_STEP = 0.15
+
+# HTTP session shared by all requests, plus the optional request cache and
+# in-flight limit installed by `shared_requests`
+_session = None
+_session_lock = threading.Lock()
+_request_cache = None
+_request_slots = None
+
+
+def get_session():
+    """Shared requests.Session so calls reuse pooled keep-alive connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=32)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
 
-def polish_chunk(chunk, creativity_level="balanced"):
+
+@contextmanager
+def shared_requests(max_in_flight=None, dedupe=True):
+    """
+    Share work between concurrent stories for the duration of the block:
+    identical seeded requests are sent once (see `RequestCache`) and at most
+    `max_in_flight` requests run at the same time. Yields the cache.
+    """
+    global _request_cache, _request_slots
+    previous = _request_cache, _request_slots
+    _request_cache = RequestCache() if dedupe else None
+    _request_slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+    try:
+        yield _request_cache
+    finally:
+        _request_cache, _request_slots = previous
+
+
+def budget_num_predict(words, tokens_per_word=TOKENS_PER_WORD):
+    """num_predict for a request with a budget of `words` words."""
+    return int(math.ceil(words * tokens_per_word * NUM_PREDICT_HEADROOM))
+
+
+def prewarm_model(model="llama3.1:8b", keep_alive="30m"):
+    """Load `model` on the Ollama server ahead of time and keep it resident."""
+    print(f"[INFO] Prewarming {model}...")
+    with span("model.prewarm", "model", model=model):
+        response = get_session().post(OLLAMA_API_URL, json={"model": model, "keep_alive": keep_alive})
+        response.raise_for_status()
+
+
+def run_parallel(fn, items, max_parallel, cancel_token=None):
+    """
+    Run `fn` over `items` with at most `max_parallel` calls in flight and return
+    the results in order. The calling thread keeps polling `cancel_token` so a
+    GUI stop button stays responsive.
+    """
+    items = list(items)
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = [executor.submit(fn, item) for item in items]
+        pending = set(futures)
+        while pending:
+            if cancel_token is not None:
+                cancel_token.is_cancelled()
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_EXCEPTION)
+            for future in done:
+                if future.exception() is not None:
+                    for other in pending:
+                        other.cancel()
+                    raise future.exception()
+    return [future.result() for future in futures]
+
+
+def polish_chunk(chunk, creativity_level="balanced", cancel_token=None, run_stats=None, stats=None, seed=None):
     """
     Polishes a story chunk to enhance readability and format it into paragraphs.
+    If generation is cancelled or the polish starts looping, the unpolished chunk is returned as-is.
     """
+    if cancel_token is not None and cancel_token.is_cancelled():
+        return chunk
+
     temp, top_p, rep_penalty = get_polish_params(creativity_level)
 
     payload = {
@@ -29,30 +127,212 @@ def polish_chunk(chunk, creativity_level="balanced"):
             "temperature": temp,
             "top_p": top_p,
             "repeat_penalty": rep_penalty,
-            "num_ctx": 4096,
-            "num_predict": 1000,
+            "num_ctx": POLISH_NUM_CTX,
+            "num_predict": POLISH_NUM_PREDICT,
         }
     }
+    if seed is not None:
+        payload["options"]["seed"] = seed
 
     print(f"[INFO] Polishing chunk with creativity level '{creativity_level}'...")
-    response = requests.post(OLLAMA_API_URL, json=payload, stream=True)
-    response.raise_for_status()
+    stats = stats if stats is not None else {}
+    polished = stream_generate(payload, cancel_token, run_stats=run_stats, kind="polish", stats=stats,
+                               detector=RepetitionDetector())
+
+    if cancel_token is not None and cancel_token.is_cancelled():
+        return chunk
+    if stats.get("degenerate"):
+        print("[WARNING] Polishing started repeating itself, keeping the unpolished chunk.")
+        return chunk
+    return polished
+
+
+def generate_chunk(payload, story_context="", cancel_token=None, word_budget=None, run_stats=None,
+                   stats=None, retry_on_repetition=True):
+    """
+    `stream_generate` guarded by a `RepetitionDetector` seeded with `story_context`.
+    A looping stream is cut and its repeated tail trimmed. If less than half of
+    `word_budget` (or, without a budget, of the words num_predict allows)
+    survives, the chunk is retried once with a higher repeat_penalty and the
+    longer of the two results is kept.
+    """
+    stats = stats if stats is not None else {}
+    text = stream_generate(payload, cancel_token, word_budget, run_stats, stats=stats,
+                           detector=RepetitionDetector(story_context))
+
+    if not stats.get("degenerate") or not retry_on_repetition:
+        return text
+    expected_words = word_budget or payload.get("options", {}).get("num_predict", 0) / TOKENS_PER_WORD
+    if not expected_words or len(text.split()) >= expected_words / 2:
+        return text
+    if cancel_token is not None and cancel_token.is_cancelled():
+        return text
 
-    return parse_streamed_response(response)
+    options = dict(payload.get("options", {}))
+    options["repeat_penalty"] = options.get("repeat_penalty", 1.1) + REPEAT_PENALTY_STEP
+    print(f"[WARNING] Generation started looping, retrying with repeat_penalty={options['repeat_penalty']:.2f}...")
 
+    retry_stats = {}
+    retry_text = stream_generate(dict(payload, options=options), cancel_token, word_budget, run_stats,
+                                 stats=retry_stats, detector=RepetitionDetector(story_context))
+    if len(retry_text.split()) > len(text.split()):
+        stats.update(retry_stats)
+        return retry_text
+    return text
 
-def parse_streamed_response(response):
+
+def stream_generate(payload, cancel_token=None, word_budget=None, run_stats=None, kind="generate",
+                    stats=None, detector=None):
+    """
+    Sends a streaming generate request and returns the generated text.
+    If `cancel_token` is cancelled the stream is closed and the partial text is returned.
+    With a `word_budget`, the stream is closed at the first sentence boundary
+    after the budget is reached. A `detector` cuts looping streams (see
+    `parse_streamed_response`). Call stats are filled into `stats` (if given)
+    and recorded into `run_stats`.
+
+    Inside `shared_requests`, seeded requests identical to an earlier one reuse
+    its result (the call stats then carry `cached=True`).
+    """
+    if cancel_token is not None and cancel_token.is_cancelled():
+        return ""
+
+    stats = stats if stats is not None else {}
+    stats["kind"] = kind
+
+    cache = _request_cache
+    if cache is not None and is_seeded(payload):
+        def compute():
+            call_stats = {"kind": kind}
+            text = _send(payload, cancel_token, word_budget, call_stats, detector)
+            cancelled = cancel_token is not None and cancel_token.cancelled
+            return (text, call_stats), not cancelled
+
+        (text, call_stats), hit = cache.get_or_compute(request_key(payload, word_budget, detector), compute)
+        stats.update(call_stats)
+        if hit:
+            stats["cached"] = True
+    else:
+        text = _send(payload, cancel_token, word_budget, stats, detector)
+
+    # upper bound: the model may have stopped on its own before the cap
+    num_predict = payload.get("options", {}).get("num_predict")
+    if (stats["stopped_early"] or stats["degenerate"]) and num_predict:
+        stats["tokens_saved"] = max(0, num_predict - stats["tokens"])
+    if run_stats is not None:
+        run_stats.record(stats)
+
+    return text
+
+
+def _send(payload, cancel_token, word_budget, stats, detector):
+    """POST one streaming request (within the in-flight limit) and parse it into `stats`."""
+    with _request_slots or nullcontext():
+        with span(f"model.{stats['kind']}", "model",
+                  num_predict=payload.get("options", {}).get("num_predict")) as trace:
+            start = time.perf_counter()
+            response = get_session().post(OLLAMA_API_URL, json=payload, stream=True)
+            response.raise_for_status()
+
+            text = parse_streamed_response(response, cancel_token, word_budget, stats, detector)
+            stats["wall_ms"] = (time.perf_counter() - start) * 1000
+            first_token_at = stats.pop("first_token_at", None)
+            stats["first_token_ms"] = (first_token_at - start) * 1000 if first_token_at else None
+            stats["prompt_words"] = len(payload.get("prompt", "").split())
+            trace.set(tokens=stats["tokens"], words=stats["words"], stopped_early=stats["stopped_early"],
+                      degenerate=stats["degenerate"])
+    return text
+
+
+def parse_streamed_response(response, cancel_token=None, word_budget=None, stats=None, detector=None):
     """
     Parses a streamed response from the Ollama API.
+    Closing the response stops the server from decoding the rest of it.
+    Words are counted as tokens arrive so the stream can end once
+    `word_budget` is reached and the text hits a sentence boundary.
+    If `detector` reports a repetition loop, the stream is closed and the
+    repeated tail is trimmed.
     """
-    text = ""
-    for line in response.iter_lines():
-        if line:
+    parts = []
+    tokens = 0
+    words = 0
+    in_word = False
+    stopped_early = False
+    degenerate = False
+    final = {}
+    first_token_at = None
+
+    unregister = cancel_token.on_cancel(response.close) if cancel_token is not None else None
+    try:
+        for line in response.iter_lines():
+            if cancel_token is not None and cancel_token.is_cancelled():
+                break
+            if not line:
+                continue
+
             parsed = json.loads(line.decode('utf-8'))
-            text += parsed.get("response", "")
+            fragment = parsed.get("response", "")
+            if parsed.get("done"):
+                final = parsed
+            if not fragment:
+                continue
+
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(fragment)
+            tokens += 1
+            for char in fragment:
+                if char.isspace():
+                    in_word = False
+                elif not in_word:
+                    in_word = True
+                    words += 1
+
+            if detector is not None and detector.feed(fragment, tokens):
+                degenerate = True
+                break
+            if word_budget is not None and words >= word_budget and _ends_sentence("".join(parts[-3:])):
+                stopped_early = True
+                break
+    except Exception:
+        # reading a stream closed by cancel() fails; keep what arrived
+        if cancel_token is None or not cancel_token.cancelled:
+            raise
+    finally:
+        if unregister is not None:
+            unregister()
+        response.close()
+
+    text = "".join(parts)
+    aborted_tokens = 0
+    if degenerate:
+        text = text[:detector.trim_offset(text)]
+        aborted_tokens = detector.aborted_tokens(tokens)
+        print(f"[WARNING] Repetition detected (score {detector.score:.2f}), "
+              f"cut the stream and dropped ~{aborted_tokens} repeated tokens.")
+
+    if stats is not None:
+        stats.update({
+            "tokens": final.get("eval_count", tokens),
+            "words": words,
+            "stopped_early": stopped_early,
+            "degenerate": degenerate,
+            "aborted_tokens": aborted_tokens,
+            "prompt_tokens": final.get("prompt_eval_count"),
+            "prompt_eval_ms": final.get("prompt_eval_duration", 0) / 1e6 or None,
+            "eval_ms": final.get("eval_duration", 0) / 1e6 or None,
+            "stream_ms": (time.perf_counter() - first_token_at) * 1000 if first_token_at else None,
+            "first_token_at": first_token_at,
+        })
     return text.strip()
 
 
+def _ends_sentence(text):
+    """True if `text` ends at a sentence boundary."""
+    tail = text.rstrip().rstrip("\"'”’)")
+    return tail.endswith((".", "!", "?"))
+
+
 def get_polish_params(creativity_level):
     """
     Returns polishing parameters based on the creativity level.
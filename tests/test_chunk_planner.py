@@ -0,0 +1,121 @@
+import pytest
+
+from story_gen.chunk_planner import ChunkPlanner
+from story_gen.story_utils import budget_num_predict
+
+
+def call_stats(prompt_tokens, tokens, decode_ms, decode_ms_per_ctx, prefill_ms=0.5, words=None):
+    """Stats of a generate call timed by the planner's own cost model."""
+    context = prompt_tokens + tokens / 2
+    return {
+        "kind": "generate",
+        "prompt_tokens": prompt_tokens,
+        "prompt_eval_ms": prompt_tokens * prefill_ms,
+        "tokens": tokens,
+        "eval_ms": tokens * (decode_ms + decode_ms_per_ctx * context),
+        "words": words or round(tokens / 1.35),
+    }
+
+
+def test_schedule_covers_the_story_and_ends_with_the_final_chunk():
+    planner = ChunkPlanner(5000)
+    plan = planner.schedule()
+
+    assert len(plan) == planner.best_chunk_count(5000)
+    assert [step["instruction"] for step in plan][-1] == "final"
+    assert sum(step["words"] for step in plan) == pytest.approx(5000, abs=len(plan))
+    for step in plan:
+        assert step["target"] <= planner.max_chunk_words()
+        assert step["num_predict"] == budget_num_predict(step["target"], planner.tokens_per_word)
+
+
+def test_schedule_marks_the_last_stretch_as_conclusion():
+    planner = ChunkPlanner(5000, max_chunk=300)
+    instructions = [step["instruction"] for step in planner.schedule()]
+
+    assert instructions[-1] == "final"
+    assert "conclusion" in instructions
+    assert instructions.index("conclusion") > len(instructions) // 2
+
+
+def test_short_chunk_lowers_fill_ratio_and_raises_the_next_target():
+    planner = ChunkPlanner(5000)
+    before = planner.schedule(4700)
+
+    planner.observe({"kind": "generate"}, target=before[0]["target"], delivered_words=before[0]["target"] / 2)
+    after = planner.schedule(4700)
+
+    assert planner.fill_ratio == pytest.approx(0.75)
+    # the same 300 words are still expected, so more are requested to get them
+    assert [step["words"] for step in after] == [step["words"] for step in before] == [300]
+    assert after[0]["target"] == 400
+    assert after[0]["num_predict"] > before[0]["num_predict"]
+
+
+def test_lower_fill_ratio_plans_more_chunks():
+    planner = ChunkPlanner(5000)
+    before = planner.schedule(1000)
+    planner.observe({}, target=500, delivered_words=250)
+    after = planner.schedule(1000)
+
+    assert len(after) > len(before)
+    assert all(step["target"] <= planner.max_chunk_words() for step in after)
+
+
+def test_fill_ratio_is_clamped():
+    planner = ChunkPlanner(5000)
+    for _ in range(10):
+        planner.observe({}, target=500, delivered_words=0)
+    assert planner.fill_ratio == pytest.approx(0.2)
+
+    for _ in range(10):
+        planner.observe({}, target=500, delivered_words=2000)
+    assert planner.fill_ratio == 1.0
+
+
+def test_decode_fit_recovers_the_rates():
+    planner = ChunkPlanner(5000)
+    for prompt_tokens in (500, 1500, 2500, 3500):
+        planner.observe(call_stats(prompt_tokens, 600, decode_ms=18.0, decode_ms_per_ctx=0.002))
+
+    assert planner.decode_ms_per_ctx == pytest.approx(0.002)
+    assert planner.decode_ms == pytest.approx(18.0)
+    assert planner.prefill_ms == pytest.approx(0.5, rel=0.1)
+
+
+def test_decode_fit_keeps_the_prior_slope_when_the_fit_is_not_sensible():
+    planner = ChunkPlanner(5000)
+    prior = planner.decode_ms_per_ctx
+    # decode getting faster with a longer context is noise, not a rate
+    for prompt_tokens in (500, 1500, 2500):
+        planner.observe(call_stats(prompt_tokens, 600, decode_ms=30.0, decode_ms_per_ctx=-0.004))
+
+    assert planner.decode_ms_per_ctx == prior
+    assert planner.decode_ms > 0
+
+
+def test_prefill_is_estimated_from_the_first_token_time_without_server_timings():
+    planner = ChunkPlanner(5000)
+    overhead = planner.overhead_ms
+    stats = {
+        "kind": "generate",
+        "prompt_tokens": None,
+        "prompt_eval_ms": None,
+        "first_token_ms": overhead + 1350 * 0.2,
+        "prompt_words": 1000,
+        "tokens": 700,
+        "stream_ms": 700 * 20.0,
+        "words": 519,
+    }
+    planner.observe(stats)
+
+    # prompt tokens estimated at prompt_words * tokens_per_word = 1350, prefill 0.2 ms/token
+    assert planner.prefill_ms == pytest.approx((0.6 + 0.2) / 2)
+    assert planner.prompt_tokens == pytest.approx((1200 + 1350) / 2)
+
+
+def test_first_token_time_below_the_overhead_is_ignored():
+    planner = ChunkPlanner(5000)
+    planner.observe({"kind": "polish", "first_token_ms": 10.0, "prompt_words": 500})
+    assert planner.prefill_ms == 0.6
+    assert planner.prompt_tokens == 1200
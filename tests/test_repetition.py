@@ -0,0 +1,66 @@
+from story_gen.repetition import RepetitionDetector
+
+STORY = (
+    "The keeper climbed the tower as the storm rolled in from the west. "
+    "Rain hammered the glass while the old lamp sputtered and caught. "
+    "Far below, a fishing boat fought the swell, its single light swinging wildly. "
+    "Ann counted the seconds between the flashes and the thunder, then ran for the bell rope. "
+    "By dawn the sea had calmed, and the boat lay safe in the harbour with its crew asleep on deck. "
+)
+LOOP = "She opened the door and saw the lamp was still burning bright. "
+
+
+def feed_words(detector, text):
+    """Feed `text` one word at a time like a stream; returns the token index the detector fired at."""
+    for index, word in enumerate(text.split(" "), 1):
+        if detector.feed(word + " ", index):
+            return index
+    return None
+
+
+def test_natural_text_is_not_degenerate():
+    detector = RepetitionDetector()
+    assert feed_words(detector, STORY) is None
+    assert detector.score == 0
+
+
+def test_self_repetition_is_detected_and_trimmed():
+    text = STORY + LOOP * 12
+    detector = RepetitionDetector()
+    fired_at = feed_words(detector, text)
+
+    assert fired_at is not None
+    assert detector.score >= detector.threshold
+
+    streamed = " ".join(text.split(" ")[:fired_at]) + " "
+    trimmed = streamed[:detector.trim_offset(streamed)]
+    # the first occurrence of the looping sentence is kept, its repeats are dropped
+    assert trimmed.rstrip() == (STORY + LOOP).rstrip()
+
+
+def test_aborted_tokens_count_from_the_start_of_the_run():
+    detector = RepetitionDetector()
+    fired_at = feed_words(detector, STORY + LOOP * 12)
+    run_start = len((STORY + LOOP).split(" "))
+
+    assert detector.aborted_tokens(fired_at) == fired_at - run_start
+    assert RepetitionDetector().aborted_tokens(50) == 0
+
+
+def test_repeating_the_story_context_is_detected():
+    detector = RepetitionDetector(context=STORY)
+    assert feed_words(detector, STORY) is not None
+
+    fresh = RepetitionDetector(context="Nothing in common with the text fed afterwards.")
+    assert feed_words(fresh, STORY) is None
+
+
+def test_trim_without_repetition_keeps_the_text():
+    detector = RepetitionDetector()
+    feed_words(detector, STORY)
+    assert detector.trim_offset(STORY) == len(STORY)
+
+
+def test_context_key_identifies_the_seeded_context():
+    assert RepetitionDetector(STORY).context_key == RepetitionDetector(" ".join(STORY.split())).context_key
+    assert RepetitionDetector(STORY).context_key != RepetitionDetector(LOOP).context_key
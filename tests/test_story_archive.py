@@ -0,0 +1,211 @@
+import multiprocessing
+import os
+
+import pytest
+
+from story_archive import StoryArchive, ArchiveError
+from story_archive import archive as archive_module
+
+
+def make_story(number, genre="Horror"):
+    return {
+        "title": f"Story {number}",
+        "caption": "A lighthouse on a cliff in a storm.",
+        "genre": genre,
+        "params": {"creativity_level": "creative" if number % 2 else "balanced", "mode": "one-shot"},
+        "chunks": [f"The keeper lit the lamp on night {number}.", f"Ship number{number} reached the harbour."],
+        "stats": {"tokens": 100 + number},
+    }
+
+
+def add_stories(path, start, count, compact_every=None):
+    if compact_every:
+        archive_module.COMPACT_EVERY = compact_every
+    with StoryArchive(path) as archive:
+        for number in range(start, start + count):
+            archive.add(make_story(number))
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "archive")
+    with StoryArchive(path) as archive:
+        ids = [archive.add(make_story(number, genre)) for number, genre in enumerate(["Horror", "Sci-Fi", "Horror"])]
+        assert ids == [0, 1, 2]
+
+        story = archive.get(1)
+        assert story["id"] == 1
+        assert story["title"] == "Story 1"
+        assert story["chunks"] == make_story(1)["chunks"]
+        assert story["stats"] == {"tokens": 101}
+        assert "created" in story
+
+        assert [s["id"] for s in archive.iter_stories()] == [2, 1, 0]
+        with pytest.raises(KeyError):
+            archive.get(3)
+
+    with StoryArchive(path) as archive:
+        assert len(archive) == 3
+        assert archive.search("lighthouse") == [2, 1, 0]
+        assert archive.search("number1") == [1]
+        assert archive.search(genre="Horror") == [2, 0]
+        assert archive.search("keeper", genre="horror", creativity_level="balanced") == [2, 0]
+        assert archive.search("keeper", genre="Horror", limit=1) == [2]
+        assert archive.search("unicorn") == []
+
+
+def test_read_only_use_does_not_create_the_directory(tmp_path):
+    path = str(tmp_path / "missing")
+    with StoryArchive(path) as archive:
+        assert len(archive) == 0
+        assert archive.search("anything") == []
+    assert not os.path.exists(path)
+
+
+def test_compaction_keeps_search_results(tmp_path, monkeypatch):
+    path = str(tmp_path / "archive")
+    with StoryArchive(path) as archive:
+        for number in range(20):
+            archive.add(make_story(number, "Horror" if number % 3 else "Comedy"))
+        before = {query: archive.search(query) for query in ("lighthouse", "number7", "night")}
+        before_genre = archive.search(genre="Comedy")
+
+        archive.compact()
+        assert os.path.getsize(os.path.join(path, "index.log")) == 0
+        assert {query: archive.search(query) for query in before} == before
+        assert archive.search(genre="Comedy") == before_genre
+
+        # stories added after a compaction are found alongside the compacted ones
+        archive.add(make_story(20, "Comedy"))
+        assert archive.search(genre="Comedy")[0] == 20
+        assert archive.search("lighthouse") == list(range(20, -1, -1))
+
+    monkeypatch.setattr(archive_module, "COMPACT_EVERY", 3)
+    with StoryArchive(path) as archive:
+        for number in range(21, 24):
+            archive.add(make_story(number))
+        with open(os.path.join(path, "index.log"), encoding="utf-8") as f:
+            assert len(f.readlines()) < 3
+        assert archive.search("number22") == [22]
+        assert len(archive.search("lighthouse")) == 24
+
+
+def test_recover_indexes_unlogged_stories_and_drops_partial_offsets(tmp_path):
+    path = str(tmp_path / "archive")
+    add_stories(path, 0, 3)
+
+    # crash after the record and offset were written but before the index line,
+    # and while the next offset entry was half written
+    log_path = os.path.join(path, "index.log")
+    with open(log_path, encoding="utf-8") as f:
+        lines = f.readlines()
+    with open(log_path, "w", encoding="utf-8") as f:
+        f.writelines(lines[:2])
+    with open(os.path.join(path, "stories.off"), "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    with StoryArchive(path) as archive:
+        assert len(archive) == 3
+        assert archive.search("number2") == [2]
+        assert archive.add(make_story(3)) == 3
+        assert archive.get(3)["title"] == "Story 3"
+
+
+def test_corrupt_record_raises(tmp_path):
+    path = str(tmp_path / "archive")
+    add_stories(path, 0, 2)
+    with open(os.path.join(path, "stories.dat"), "r+b") as f:
+        f.seek(-5, os.SEEK_END)
+        f.write(b"XXXXX")
+
+    with StoryArchive(path) as archive:
+        assert archive.get(0)["title"] == "Story 0"
+        with pytest.raises(ArchiveError):
+            archive.get(1)
+
+
+@pytest.mark.skipif(archive_module.fcntl is None, reason="needs fcntl")
+@pytest.mark.parametrize("compact_every", [None, 7])
+def test_concurrent_writers_keep_ids_and_offsets_consistent(tmp_path, compact_every):
+    path = str(tmp_path / "archive")
+    context = multiprocessing.get_context("spawn")
+    writers = [context.Process(target=add_stories, args=(path, start, 40, compact_every))
+               for start in (0, 1000, 2000)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+
+    with StoryArchive(path) as archive:
+        assert len(archive) == 120
+        titles = sorted(story["title"] for story in archive.iter_stories())
+        expected = sorted(f"Story {start + number}" for start in (0, 1000, 2000) for number in range(40))
+        assert titles == expected
+        assert len(archive.search("lighthouse")) == 120
+        for story in archive.iter_stories():
+            number = story["title"].split()[1]
+            assert archive.search(f"number{number}") == [story["id"]]
+
+
+def test_compaction_moves_readers_to_the_next_generation(tmp_path):
+    path = str(tmp_path / "archive")
+    writer = StoryArchive(path)
+    for number in range(5):
+        writer.add(make_story(number))
+    writer.compact()
+    assert sorted(name for name in os.listdir(path) if ".lex" in name) == ["index.1.lex"]
+
+    reader = StoryArchive(path)
+    assert reader.search("lighthouse") == [4, 3, 2, 1, 0]
+
+    for number in range(5, 8):
+        writer.add(make_story(number))
+    writer.compact()
+    with open(os.path.join(path, "index.cur"), encoding="ascii") as f:
+        assert f.read() == "2"
+    assert sorted(name for name in os.listdir(path) if ".lex" in name) == ["index.2.lex"]
+
+    # the reader still holds generation 1 and follows the pointer to generation 2
+    assert reader.search("lighthouse") == list(range(7, -1, -1))
+    assert reader.search("number6") == [6]
+    reader.close()
+    writer.close()
+
+
+def test_single_file_lexicon_is_upgraded_on_compaction(tmp_path):
+    path = str(tmp_path / "archive")
+    with StoryArchive(path) as archive:
+        for number in range(4):
+            archive.add(make_story(number))
+        archive.compact()
+    # archives written before lexicon generations have a single index.lex and no pointer
+    os.replace(os.path.join(path, "index.1.lex"), os.path.join(path, "index.lex"))
+    os.remove(os.path.join(path, "index.cur"))
+
+    with StoryArchive(path) as archive:
+        assert archive.search("number2") == [2]
+        archive.add(make_story(4))
+        archive.compact()
+        assert archive.search("lighthouse") == [4, 3, 2, 1, 0]
+    assert sorted(name for name in os.listdir(path) if ".lex" in name) == ["index.1.lex"]
+
+
+def test_repeated_compactions_match_a_full_scan(tmp_path):
+    import random
+
+    rng = random.Random(7)
+    vocabulary = [f"word{index}" for index in range(60)]
+    path = str(tmp_path / "archive")
+    texts = []
+    with StoryArchive(path) as archive:
+        for round_number in range(3):
+            for _ in range(15):
+                text = " ".join(rng.sample(vocabulary, 8))
+                texts.append(text)
+                archive.add({"title": "", "caption": "", "genre": "Horror", "chunks": [text]})
+            if round_number < 2:
+                archive.compact()
+
+        for word in vocabulary:
+            expected = [story_id for story_id in range(len(texts) - 1, -1, -1) if word in texts[story_id].split()]
+            assert archive.search(word) == expected
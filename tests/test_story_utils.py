@@ -0,0 +1,115 @@
+import json
+
+from story_gen.cancellation import CancellationToken
+from story_gen.repetition import RepetitionDetector
+from story_gen.story_utils import parse_streamed_response, _ends_sentence
+
+
+class FakeResponse:
+    """Streamed Ollama response yielding one JSON line per fragment."""
+
+    def __init__(self, fragments, final=None):
+        self.fragments = fragments
+        self.final = final
+        self.read = 0
+        self.closed = False
+
+    def iter_lines(self):
+        for fragment in self.fragments:
+            if self.closed:
+                raise ValueError("stream closed")
+            self.read += 1
+            yield json.dumps({"response": fragment, "done": False}).encode("utf-8")
+        if self.final is not None:
+            yield json.dumps(dict(self.final, response="", done=True)).encode("utf-8")
+
+    def close(self):
+        self.closed = True
+
+
+def fragments(text):
+    """Split `text` into word-sized fragments like streamed tokens."""
+    words = text.split(" ")
+    return [word if index == 0 else " " + word for index, word in enumerate(words)]
+
+
+TEXT = ("The storm broke at midnight. Ann ran up the tower stairs two at a time, "
+        "counting every step. The lamp was dark! She struck a match. Then the ship came.")
+
+
+def test_stream_stops_at_the_first_sentence_boundary_past_the_budget():
+    response = FakeResponse(fragments(TEXT))
+    stats = {}
+    text = parse_streamed_response(response, word_budget=8, stats=stats)
+
+    # the budget is met mid-sentence; the stream runs on to the end of that sentence
+    assert text == "The storm broke at midnight. Ann ran up the tower stairs two at a time, counting every step."
+    assert stats["stopped_early"] is True
+    assert stats["words"] == len(text.split())
+    assert response.read == len(fragments(text))
+    assert response.closed
+
+
+def test_budget_on_a_boundary_stops_immediately():
+    stats = {}
+    text = parse_streamed_response(FakeResponse(fragments(TEXT)), word_budget=5, stats=stats)
+    assert text == "The storm broke at midnight."
+    assert stats["stopped_early"] is True
+
+
+def test_without_a_budget_the_whole_stream_is_read():
+    final = {"eval_count": 40, "prompt_eval_count": 120, "prompt_eval_duration": 60_000_000,
+             "eval_duration": 800_000_000}
+    stats = {}
+    text = parse_streamed_response(FakeResponse(fragments(TEXT), final), stats=stats)
+
+    assert text == TEXT
+    assert stats["stopped_early"] is False
+    assert stats["tokens"] == 40
+    assert stats["prompt_tokens"] == 120
+    assert stats["prompt_eval_ms"] == 60
+    assert stats["eval_ms"] == 800
+
+
+def test_budget_larger_than_the_text_does_not_stop_early():
+    stats = {}
+    assert parse_streamed_response(FakeResponse(fragments(TEXT)), word_budget=500, stats=stats) == TEXT
+    assert stats["stopped_early"] is False
+    assert stats["tokens"] == len(fragments(TEXT))
+
+
+def test_cancelled_stream_keeps_the_partial_text():
+    token = CancellationToken()
+    response = FakeResponse(fragments(TEXT))
+    lines = response.iter_lines()
+
+    class CancelAfterFive(FakeResponse):
+        def iter_lines(self):
+            for index, line in enumerate(lines):
+                if index == 5:
+                    token.cancel()
+                yield line
+
+    text = parse_streamed_response(CancelAfterFive([]), cancel_token=token)
+    assert text == "The storm broke at midnight."
+
+
+def test_looping_stream_is_trimmed():
+    loop = " She opened the door and saw the lamp was still burning bright." * 12
+    stats = {}
+    text = parse_streamed_response(FakeResponse(fragments(TEXT + loop)), stats=stats,
+                                   detector=RepetitionDetector())
+
+    assert stats["degenerate"] is True
+    assert text == TEXT + " She opened the door and saw the lamp was still burning bright."
+    assert stats["aborted_tokens"] > 0
+
+
+def test_ends_sentence():
+    assert _ends_sentence("It was over.")
+    assert _ends_sentence("Run!  ")
+    assert _ends_sentence('"Who is there?"')
+    assert _ends_sentence("(quietly.)")
+    assert not _ends_sentence("It was over")
+    assert not _ends_sentence("Mr")
+    assert not _ends_sentence("one, two,")
@@ -0,0 +1,6 @@
+"""
+Pipeline Stage Tracing Module
+"""
+
+from .tracer import (span, traced, enable_tracing, disable_tracing, is_enabled,
+                     export_chrome_trace, summary_table)
@@ -0,0 +1,187 @@
+"""
+Span-based tracer for the story pipeline.
+
+Tracing is off by default: `span()` then returns a shared no-op context
+manager, so instrumented code only pays for one global lookup. Once
+`enable_tracing()` is called, every span is recorded with its thread and can be
+exported as Chrome trace-event JSON (open it in https://ui.perfetto.dev) or
+summarized as a table.
+"""
+
+import functools
+import json
+import threading
+import time
+
+_tracer = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.record(self.name, self.category, self.start, end, self.args)
+        return False
+
+    def set(self, **args):
+        """Attach extra arguments (e.g. token counts) to the span."""
+        self.args.update(args)
+
+
+class Tracer:
+    """Collects finished spans from all threads."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, category, start, end, args):
+        ident = threading.get_ident()
+        with self._lock:
+            if ident not in self.threads:
+                self.threads[ident] = (len(self.threads) + 1, threading.current_thread().name)
+            tid = self.threads[ident][0]
+            self.events.append((name, category, start, end, tid, args))
+
+
+def enable_tracing():
+    """Start recording spans. Returns the active tracer."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def disable_tracing():
+    """Stop recording spans and drop the collected ones."""
+    global _tracer
+    _tracer = None
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def span(name, category="pipeline", **args):
+    """
+    Context manager timing one pipeline stage.
+
+    Usage:
+        with span("model.generate", "model", num_predict=600) as s:
+            ...
+            s.set(tokens=512)
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, category, args)
+
+
+def traced(name, category="pipeline"):
+    """Decorator recording every call of the function as a span."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            with _Span(tracer, name, category, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def export_chrome_trace(path):
+    """Write the recorded spans as Chrome trace-event JSON."""
+    tracer = _tracer
+    if tracer is None:
+        raise RuntimeError("Tracing is not enabled.")
+
+    with tracer._lock:
+        events = list(tracer.events)
+        threads = dict(tracer.threads)
+
+    trace_events = [
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread_name}}
+        for tid, thread_name in threads.values()
+    ]
+    for name, category, start, end, tid, args in events:
+        trace_events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - tracer.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": 1,
+            "tid": tid,
+            "args": args,
+        })
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+
+def summary_table():
+    """
+    Per-stage summary of the recorded spans: call count, total, mean and max
+    time, and the share of the run's wall time.
+    """
+    tracer = _tracer
+    if tracer is None or not tracer.events:
+        return "No spans recorded."
+
+    with tracer._lock:
+        events = list(tracer.events)
+
+    wall = max(end for _, _, _, end, _, _ in events) - min(start for _, _, start, _, _, _ in events)
+    stages = {}
+    for name, category, start, end, _, _ in events:
+        stage = stages.setdefault(name, [category, 0, 0.0, 0.0])
+        stage[1] += 1
+        stage[2] += end - start
+        stage[3] = max(stage[3], end - start)
+
+    lines = [
+        f"{'stage':<24}{'category':<10}{'calls':>6}{'total s':>10}{'mean s':>9}{'max s':>9}{'% wall':>8}",
+        "-" * 76,
+    ]
+    for name, (category, calls, total, longest) in sorted(stages.items(), key=lambda item: -item[1][2]):
+        lines.append(
+            f"{name:<24}{category:<10}{calls:>6}{total:>10.2f}{total / calls:>9.2f}"
+            f"{longest:>9.2f}{(total / wall * 100) if wall else 0:>7.1f}%"
+        )
+    lines.append("-" * 76)
+    lines.append(f"Run wall time: {wall:.2f}s (nested and parallel stages can add up to more than 100%)")
+    return "\n".join(lines)
@@ -1,5 +0,0 @@
-"""
-Enhanced UI Module for Story Generator
-"""
-
-from .ui import setup_window, update_window, show_completion_message, update_status
\ No newline at end of file
@@ -0,0 +1,15 @@
+"""
+Enhanced UI Module for Story Generator
+
+tkinter is only imported the first time one of the UI functions is used,
+so the rest of the pipeline can be imported on machines without Tk.
+"""
+
+__all__ = ["setup_window", "update_window", "show_completion_message", "update_status"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import ui
+        return getattr(ui, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
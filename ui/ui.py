@@ -2,10 +2,17 @@ import tkinter as tk
 from tkinter import scrolledtext, ttk
 import tkinter.font as tkFont
 
-def setup_window():
+from tracer import traced
+
+@traced("ui.setup_window", "ui")
+def setup_window(on_stop=None):
     """
     Sets up the main tkinter window with enhanced visual appeal.
     
+    Args:
+        on_stop: Optional callback for the stop button. The button is only
+            shown when a callback is given.
+    
     Returns:
         window: The main tkinter window instance.
         text_widget: The text area widget for displaying the story.
@@ -113,7 +120,30 @@ def setup_window():
         fg=accent_color,
         anchor="w"
     )
-    status_label.pack(fill=tk.X, padx=5)
+    
+    # Stop button for in-flight generation
+    if on_stop is not None:
+        def handle_stop():
+            stop_button.config(state=tk.DISABLED, text="■ Stopping...")
+            status_label.config(text="● Stopping generation, keeping the story so far...", fg=highlight_color)
+            on_stop()
+        
+        stop_button = tk.Button(
+            status_frame,
+            text="■ Stop",
+            font=("Segoe UI", 10, "bold"),
+            bg=secondary_bg,
+            fg=highlight_color,
+            activebackground=highlight_color,
+            activeforeground=bg_color,
+            relief=tk.FLAT,
+            padx=12,
+            command=handle_stop
+        )
+        stop_button.pack(side=tk.RIGHT, padx=5)
+        window.stop_button = stop_button
+    
+    status_label.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
     
     # Add some visual polish with separator lines
     separator1 = tk.Frame(main_frame, height=1, bg=accent_color)
@@ -131,6 +161,7 @@ def setup_window():
     window.update()
     return window, text_widget
 
+@traced("ui.update_window", "ui")
 def update_window(window, text_widget, new_text):
     """
     Updates the text widget with new story content and adds visual feedback.
@@ -166,6 +197,7 @@ def update_window(window, text_widget, new_text):
     text_widget.configure(bg="#1f1f35")  # Slightly lighter background
     window.after(100, lambda: text_widget.configure(bg=original_bg))
 
+@traced("ui.completion_message", "ui")
 def show_completion_message(window):
     """
     Shows a completion message when the story is finished.
@@ -178,7 +210,10 @@ def show_completion_message(window):
             text="✅ Story completed! Your masterpiece is ready.",
             fg="#a6e3a1"  # Green color for completion
         )
+    if hasattr(window, 'stop_button'):
+        window.stop_button.config(state=tk.DISABLED)
 
+@traced("ui.update_status", "ui")
 def update_status(window, message, color=None):
     """
     Updates the status bar with a custom message.